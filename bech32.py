@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+import sys
+import time
+import os
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# -------------------- 常量 --------------------
+CHARSET = 'qpzry9x8gf2tvdw0s3jn54khce6mua7l'
+GEN = [0x3b6a57b2, 0x26508e6d, 0x1ea119fa, 0x3d4233dd, 0x2a1462b3]
+BECH32 = 1
+BECH32M = 2
+BECH32M_CONST = 0x2bc830a3
+CHECKSUM_CONST = {BECH32: 1, BECH32M: BECH32M_CONST}
+MAX_LENGTH = 90
+
+# 字符 -> 5位数值，非法字符为-1；大写字母同样映射（大小写混用由解码器单独检查）
+CHARSET_REV = [-1] * 128
+for _i, _c in enumerate(CHARSET):
+    CHARSET_REV[ord(_c)] = _i
+    CHARSET_REV[ord(_c.upper())] = _i
+
+# -------------------- 查表polymod --------------------
+# polymod对状态的高位是GF(2)线性的：把最高10位移出的结果预先算好，一次处理两个5位符号，
+# 循环次数减半且省去逐位判断生成多项式
+def _shift_effect(top, steps):
+    chk = top << (30 - 5 * steps)
+    for _ in range(steps):
+        b = chk >> 25
+        chk = (chk & 0x1ffffff) << 5
+        for i in range(5):
+            if (b >> i) & 1:
+                chk ^= GEN[i]
+    return chk
+
+TABLE5 = [_shift_effect(top, 1) for top in range(32)]
+TABLE10 = [_shift_effect(top, 2) for top in range(1024)]
+
+def polymod_step(chk, values):
+    """从状态chk开始依次吸收values中的5位符号，返回新状态"""
+    n = len(values)
+    i = 0
+    if n & 1:
+        chk = ((chk & 0x1ffffff) << 5) ^ values[0] ^ TABLE5[chk >> 25]
+        i = 1
+    t10 = TABLE10
+    while i < n:
+        chk = ((chk & 0xfffff) << 10) ^ (values[i] << 5 | values[i + 1]) ^ t10[chk >> 20]
+        i += 2
+    return chk
+
+def bech32_polymod(values):
+    return polymod_step(1, values)
+
+def bech32_hrp_expand(hrp):
+    return [ord(x) >> 5 for x in hrp] + [0] + [ord(x) & 31 for x in hrp]
+
+def bech32_verify_checksum(hrp, data):
+    """返回校验和对应的编码（BECH32 / BECH32M），都不匹配时返回None"""
+    const = bech32_polymod(bech32_hrp_expand(hrp) + data)
+    if const == 1:
+        return BECH32
+    if const == BECH32M_CONST:
+        return BECH32M
+    return None
+
+def bech32_create_checksum(hrp, data, spec=BECH32):
+    values = bech32_hrp_expand(hrp) + data
+    polymod = bech32_polymod(values + [0, 0, 0, 0, 0, 0]) ^ CHECKSUM_CONST[spec]
+    return [(polymod >> 5 * (5 - i)) & 31 for i in range(6)]
+
+def bech32_encode(hrp, data, spec=BECH32):
+    combined = data + bech32_create_checksum(hrp, data, spec)
+    return hrp + '1' + ''.join([CHARSET[d] for d in combined])
+
+def bech32_decode(bech):
+    """解码并校验Bech32/Bech32m字符串，返回(hrp, 数据, 编码)，格式或校验和错误时返回(None, None, None)"""
+    if len(bech) > MAX_LENGTH or not bech.isascii():
+        return (None, None, None)
+    if bech.lower() != bech and bech.upper() != bech:
+        return (None, None, None)
+    bech = bech.lower()
+    pos = bech.rfind('1')
+    if pos < 1 or pos + 7 > len(bech):
+        return (None, None, None)
+    hrp = bech[:pos]
+    if any(ord(x) < 33 or ord(x) > 126 for x in hrp):
+        return (None, None, None)
+    data = [CHARSET_REV[ord(x)] for x in bech[pos + 1:]]
+    if -1 in data:
+        return (None, None, None)
+    spec = bech32_verify_checksum(hrp, data)
+    if spec is None:
+        return (None, None, None)
+    return (hrp, data[:-6], spec)
+
+def convertbits(data, frombits, tobits, pad=True):
+    acc = 0
+    bits = 0
+    ret = []
+    maxv = (1 << tobits) - 1
+    max_acc = (1 << (frombits + tobits - 1)) - 1
+    for value in data:
+        if value < 0 or (value >> frombits):
+            return None
+        acc = ((acc << frombits) | value) & max_acc
+        bits += frombits
+        while bits >= tobits:
+            bits -= tobits
+            ret.append((acc >> bits) & maxv)
+    if pad:
+        if bits:
+            ret.append((acc << (tobits - bits)) & maxv)
+    elif bits >= frombits or ((acc << (tobits - bits)) & maxv):
+        return None
+    return ret
+
+# -------------------- SegWit地址 --------------------
+def _program_symbols(program):
+    """8位字节转5位符号：整体转成一个整数后按5位切分，比逐字节累加快"""
+    nbits = len(program) * 8
+    count = (nbits + 4) // 5
+    n = int.from_bytes(program, 'big') << (count * 5 - nbits)
+    return [(n >> (5 * (count - 1 - i))) & 31 for i in range(count)]
+
+def encode_segwit_address(hrp, witver, witprog):
+    """见证版本0使用Bech32，1及以上使用Bech32m（BIP350）"""
+    spec = BECH32 if witver == 0 else BECH32M
+    return bech32_encode(hrp, [witver] + _program_symbols(bytes(witprog)), spec)
+
+def decode_segwit_address(hrp, addr):
+    """返回(见证版本, 见证程序bytes)，地址无效时返回(None, None)；hrp为None时接受任意前缀"""
+    hrpgot, data, spec = bech32_decode(addr)
+    if hrpgot is None or (hrp is not None and hrpgot != hrp) or not data:
+        return (None, None)
+    decoded = convertbits(data[1:], 5, 8, False)
+    if decoded is None or len(decoded) < 2 or len(decoded) > 40:
+        return (None, None)
+    witver = data[0]
+    if witver > 16:
+        return (None, None)
+    if witver == 0 and len(decoded) != 20 and len(decoded) != 32:
+        return (None, None)
+    if (witver == 0) != (spec == BECH32):
+        return (None, None)
+    return (witver, bytes(decoded))
+
+def is_valid_address(addr, hrp=None):
+    return decode_segwit_address(hrp, addr)[0] is not None
+
+def validate_addresses(addresses, hrp=None):
+    """批量校验，返回与输入等长的布尔列表；有numpy时按（长度, 分隔符位置）分组后整组计算"""
+    addresses = list(addresses)
+    if np is None or len(addresses) < 64:
+        return [decode_segwit_address(hrp, addr)[0] is not None for addr in addresses]
+    groups = {}
+    for index, addr in enumerate(addresses):
+        groups.setdefault((len(addr), addr.rfind('1')), []).append(index)
+    result = [False] * len(addresses)
+    for (length, pos), indices in groups.items():
+        if length > MAX_LENGTH or pos < 1 or pos + 7 > length:
+            continue
+        try:
+            raw = "".join(addresses[i] for i in indices).encode('ascii')
+        except UnicodeEncodeError:
+            for i in indices:
+                result[i] = decode_segwit_address(hrp, addresses[i])[0] is not None
+            continue
+        for i, ok in zip(indices, _validate_group(np.frombuffer(raw, dtype=np.uint8).reshape(-1, length), pos, hrp)):
+            result[i] = bool(ok)
+    return result
+
+_REV_TABLE = None
+
+def _validate_group(rows, pos, hrp):
+    """rows为(n, 长度)的ASCII矩阵，所有地址的分隔符都在pos处"""
+    global _REV_TABLE
+    if _REV_TABLE is None:
+        _REV_TABLE = np.full(256, 255, dtype=np.uint8)
+        for value, c in enumerate(CHARSET):
+            _REV_TABLE[ord(c)] = value
+    upper = (rows >= ord('A')) & (rows <= ord('Z'))
+    lower = (rows >= ord('a')) & (rows <= ord('z'))
+    valid = ~(upper.any(axis=1) & lower.any(axis=1))
+    rows = rows | (upper.astype(np.uint8) << 5)
+    valid &= ((rows[:, :pos] >= 33) & (rows[:, :pos] <= 126)).all(axis=1)
+    data = _REV_TABLE[rows[:, pos + 1:]]
+    valid &= (data != 255).all(axis=1)
+    data = data.astype(np.uint32)
+    ndata = data.shape[1]
+    # 程序长度和填充位由数据长度决定，整组相同
+    program_bits = (ndata - 7) * 5
+    program_length = program_bits // 8
+    padding = program_bits % 8
+    if padding >= 5 or program_length < 2 or program_length > 40:
+        return np.zeros(len(rows), dtype=bool)
+    if padding:
+        valid &= (data[:, -7] & ((1 << padding) - 1)) == 0
+    witver = data[:, 0]
+    valid &= witver <= 16
+    if program_length not in (20, 32):
+        valid &= witver != 0
+    table5 = np.array(TABLE5, dtype=np.uint32)
+    table10 = np.array(TABLE10, dtype=np.uint32)
+    hrps, inverse = np.unique(rows[:, :pos], axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    chk = np.zeros(len(rows), dtype=np.uint32)
+    for k, hrp_bytes in enumerate(hrps):
+        group_hrp = hrp_bytes.tobytes().decode('ascii')
+        if hrp is not None and group_hrp != hrp:
+            valid &= inverse != k
+        chk[inverse == k] = bech32_polymod(bech32_hrp_expand(group_hrp))
+    i = 0
+    if ndata & 1:
+        chk = ((chk & 0x1ffffff) << 5) ^ data[:, 0] ^ table5[chk >> 25]
+        i = 1
+    while i < ndata:
+        chk = ((chk & 0xfffff) << 10) ^ (data[:, i] << 5 | data[:, i + 1]) ^ table10[chk >> 20]
+        i += 2
+    valid &= ((witver == 0) & (chk == 1)) | ((witver != 0) & (chk == BECH32M_CONST))
+    return valid
+
+# -------------------- 批量编码 --------------------
+def encode_segwit_addresses(hrp, witver, programs):
+    """把一批等长见证程序（如P2WPKH的20字节哈希）编码为地址。
+    hrp和见证版本部分的polymod状态只算一次；有numpy时所有地址按列同时计算"""
+    programs = [bytes(p) for p in programs]
+    if not programs:
+        return []
+    length = len(programs[0])
+    if any(len(p) != length for p in programs):
+        raise ValueError("批量编码要求见证程序长度相同")
+    if np is None or len(programs) < 64:
+        return [encode_segwit_address(hrp, witver, p) for p in programs]
+    spec = BECH32 if witver == 0 else BECH32M
+    prefix_state = polymod_step(1, bech32_hrp_expand(hrp) + [witver])
+    nbits = length * 8
+    count = (nbits + 4) // 5
+    # (n, length) 字节 -> (n, count) 个5位符号
+    bits = np.unpackbits(np.frombuffer(b"".join(programs), dtype=np.uint8).reshape(-1, length), axis=1)
+    if count * 5 > nbits:
+        bits = np.pad(bits, ((0, 0), (0, count * 5 - nbits)))
+    symbols = (bits.reshape(-1, count, 5).astype(np.uint32) << np.arange(4, -1, -1, dtype=np.uint32)).sum(
+        axis=2, dtype=np.uint32)
+    table5 = np.array(TABLE5, dtype=np.uint32)
+    table10 = np.array(TABLE10, dtype=np.uint32)
+    values = np.concatenate([symbols, np.zeros((len(programs), 6), dtype=np.uint32)], axis=1)
+    chk = np.full(len(programs), prefix_state, dtype=np.uint32)
+    i = 0
+    if values.shape[1] & 1:
+        chk = ((chk & 0x1ffffff) << 5) ^ values[:, 0] ^ table5[chk >> 25]
+        i = 1
+    while i < values.shape[1]:
+        chk = ((chk & 0xfffff) << 10) ^ (values[:, i] << 5 | values[:, i + 1]) ^ table10[chk >> 20]
+        i += 2
+    chk ^= CHECKSUM_CONST[spec]
+    checksum = (chk[:, None] >> np.arange(25, -1, -5, dtype=np.uint32)) & 31
+    charset = np.frombuffer(CHARSET.encode(), dtype=np.uint8)
+    head = (hrp + '1' + CHARSET[witver]).encode()
+    body = charset[np.concatenate([symbols, checksum], axis=1)]
+    rows = np.concatenate([np.tile(np.frombuffer(head, dtype=np.uint8), (len(programs), 1)), body], axis=1)
+    width = rows.shape[1]
+    text = rows.tobytes().decode('ascii')
+    return [text[i:i + width] for i in range(0, len(text), width)]
+
+# -------------------- 基准测试 --------------------
+def benchmark(count=200000):
+    hashes = [os.urandom(20) for _ in range(count)]
+    start = time.perf_counter()
+    addresses = encode_segwit_addresses("bc", 0, hashes)
+    encoded = count / (time.perf_counter() - start)
+    start = time.perf_counter()
+    valid = sum(validate_addresses(addresses))
+    validated = count / (time.perf_counter() - start)
+    print(f"批量编码: {encoded:,.0f} 个/秒（numpy: {'是' if np is not None else '否'}）")
+    print(f"地址校验: {validated:,.0f} 个/秒，有效 {valid}/{count}")
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "benchmark":
+        benchmark()
+    else:
+        # 从标准输入逐行读取地址，输出无效的地址
+        invalid = 0
+        for line in sys.stdin:
+            addr = line.strip()
+            if addr and not is_valid_address(addr):
+                print(addr)
+                invalid += 1
+        sys.exit(1 if invalid else 0)
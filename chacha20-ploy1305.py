@@ -1,4 +1,6 @@
 import os
+import hmac
+import numpy as np
 
 # ------------------ 工具函数 ------------------
 def rotl32(value, shift):
@@ -40,66 +42,323 @@ def chacha20_block(key, counter, nonce):
         quarter_round(working_state, 2, 7, 8, 13)
         quarter_round(working_state, 3, 4, 9, 14)
     return [(working_state[i] + state[i]) & 0xffffffff for i in range(16)]
+# ------------------ 批量密钥流引擎 ------------------
+CHACHA20_CONSTANTS = np.array([0x61707865, 0x3320646e, 0x79622d32, 0x6b206574], dtype=np.uint32)
+BATCH_BLOCKS = 16384  # 每批并行计算的块数（1 MiB 密钥流）
+
+def _rotl32_lanes(v, shift, tmp):
+    """对一整行uint32通道原地循环左移"""
+    np.right_shift(v, 32 - shift, out=tmp)
+    np.left_shift(v, shift, out=v)
+    v |= tmp
+
+def _quarter_round_lanes(x, a, b, c, d, tmp):
+    """Quarter Round的向量化版本，每一列是一个独立的块"""
+    x[a] += x[b]
+    x[d] ^= x[a]
+    _rotl32_lanes(x[d], 16, tmp)
+
+    x[c] += x[d]
+    x[b] ^= x[c]
+    _rotl32_lanes(x[b], 12, tmp)
+
+    x[a] += x[b]
+    x[d] ^= x[a]
+    _rotl32_lanes(x[d], 8, tmp)
+
+    x[c] += x[d]
+    x[b] ^= x[c]
+    _rotl32_lanes(x[b], 7, tmp)
+
+def chacha20_keystream(key, counter, nonce, nblocks):
+    """一次计算nblocks个连续计数器的密钥流块，返回uint8数组"""
+    state = np.empty((16, nblocks), dtype=np.uint32)
+    state[0:4] = CHACHA20_CONSTANTS[:, None]
+    state[4:12] = np.frombuffer(key, dtype='<u4')[:, None]
+    state[12] = (counter + np.arange(nblocks, dtype=np.uint64)) & 0xffffffff
+    state[13:16] = np.frombuffer(nonce, dtype='<u4')[:, None]
+    x = state.copy()
+    tmp = np.empty(nblocks, dtype=np.uint32)
+    for _ in range(10):
+        _quarter_round_lanes(x, 0, 4, 8, 12, tmp)
+        _quarter_round_lanes(x, 1, 5, 9, 13, tmp)
+        _quarter_round_lanes(x, 2, 6, 10, 14, tmp)
+        _quarter_round_lanes(x, 3, 7, 11, 15, tmp)
+        _quarter_round_lanes(x, 0, 5, 10, 15, tmp)
+        _quarter_round_lanes(x, 1, 6, 11, 12, tmp)
+        _quarter_round_lanes(x, 2, 7, 8, 13, tmp)
+        _quarter_round_lanes(x, 3, 4, 9, 14, tmp)
+    x += state
+    # 转置后每一行是一个完整的64字节块
+    return np.ascontiguousarray(x.T, dtype='<u4').view(np.uint8).reshape(-1)
+
+def chacha20_xor(key, counter, nonce, src, dst):
+    """将密钥流异或进预分配的缓冲区dst（可与src为同一块内存）"""
+    src = np.frombuffer(src, dtype=np.uint8)
+    dst = np.frombuffer(dst, dtype=np.uint8)
+    batch_bytes = BATCH_BLOCKS * 64
+    for start in range(0, len(src), batch_bytes):
+        end = min(start + batch_bytes, len(src))
+        keystream = chacha20_keystream(key, counter + start // 64, nonce, (end - start + 63) // 64)
+        np.bitwise_xor(src[start:end], keystream[:end - start], out=dst[start:end])
+
 def chacha20_encrypt(key, counter, nonce, plaintext):
     """使用ChaCha20加密数据"""
-    keystream = b''
-    for block_counter in range((len(plaintext) + 63) // 64):
-        block = chacha20_block(key, counter + block_counter, nonce)
-        keystream += b''.join(word.to_bytes(4, 'little') for word in block)
-    return bytes([p ^ k for p, k in zip(plaintext, keystream)])
+    out = bytearray(len(plaintext))
+    chacha20_xor(key, counter, nonce, plaintext, out)
+    return bytes(out)
+
+class ChaCha20Stream:
+    """可分块调用的ChaCha20，块计数器和未用完的密钥流在多次update之间保留"""
+    def __init__(self, key, counter, nonce):
+        self.key = key
+        self.counter = counter
+        self.nonce = nonce
+        self._leftover = np.empty(0, dtype=np.uint8)
+
+    def update_into(self, data, out):
+        """把data异或密钥流后写入out"""
+        src = np.frombuffer(data, dtype=np.uint8)
+        dst = np.frombuffer(out, dtype=np.uint8)
+        n = len(src)
+        pos = min(len(self._leftover), n)
+        if pos:
+            np.bitwise_xor(src[:pos], self._leftover[:pos], out=dst[:pos])
+            self._leftover = self._leftover[pos:]
+        full = (n - pos) // 64 * 64
+        if full:
+            chacha20_xor(self.key, self.counter, self.nonce, src[pos:pos + full], dst[pos:pos + full])
+            self.counter += full // 64
+            pos += full
+        if pos < n:
+            keystream = chacha20_keystream(self.key, self.counter, self.nonce, 1)
+            self.counter += 1
+            np.bitwise_xor(src[pos:], keystream[:n - pos], out=dst[pos:])
+            self._leftover = keystream[n - pos:]
+
+    def update(self, data):
+        out = bytearray(len(data))
+        self.update_into(data, out)
+        return bytes(out)
 # ------------------ Poly1305 实现 ------------------
+POLY1305_P = (1 << 130) - 5
+POLY1305_BATCH = 128  # 每次用r的幂折叠的块数，保证26位分量之积的累加不溢出uint64
+LIMB_MASK = np.uint64((1 << 26) - 1)
+
+def _poly1305_limbs(words):
+    """把(n, 2)的小端uint64块拆成5个26位分量，并置上第129位"""
+    lo = words[:, 0]
+    hi = words[:, 1]
+    limbs = np.empty((5, len(words)), dtype=np.uint64)
+    np.bitwise_and(lo, LIMB_MASK, out=limbs[0])
+    np.bitwise_and(lo >> np.uint64(26), LIMB_MASK, out=limbs[1])
+    np.bitwise_and((lo >> np.uint64(52)) | (hi << np.uint64(12)), LIMB_MASK, out=limbs[2])
+    np.bitwise_and(hi >> np.uint64(14), LIMB_MASK, out=limbs[3])
+    np.bitwise_or(hi >> np.uint64(40), np.uint64(1 << 24), out=limbs[4])
+    return limbs
+
+class Poly1305:
+    """增量式Poly1305，不足16字节的尾部缓存到下一次update"""
+    def __init__(self, key):
+        self.r = int.from_bytes(key[:16], 'little') & 0x0ffffffc0ffffffc0ffffffc0fffffff
+        self.s = int.from_bytes(key[16:32], 'little')
+        self.accumulator = 0  # 只做部分约简，finalize时再完整模p
+        self._buffer = bytearray()
+        self._powers = None
+
+    def _power_limbs(self):
+        """预计算r^BATCH..r^1的26位分量表，第i行对应批内第i块"""
+        if self._powers is None:
+            powers = [1]
+            for _ in range(POLY1305_BATCH):
+                powers.append(powers[-1] * self.r % POLY1305_P)
+            self._powers = np.array(
+                [[(powers[POLY1305_BATCH - i] >> (26 * j)) & 0x3ffffff for j in range(5)]
+                 for i in range(POLY1305_BATCH)],
+                dtype=np.uint64,
+            )
+            self._r_batch = powers[POLY1305_BATCH]
+        return self._powers
+
+    def _batched(self, data, accumulator):
+        """每POLY1305_BATCH块做一次约简：acc = acc*r^k + Σ m_i*r^(k-i)"""
+        groups = len(data) // (16 * POLY1305_BATCH)
+        limbs = _poly1305_limbs(np.frombuffer(data, dtype='<u8').reshape(-1, 2))
+        products = limbs.reshape(5, groups, POLY1305_BATCH).transpose(1, 0, 2) @ self._power_limbs()
+        # products[g, a, b]是分量a与b的乘积之和，按a+b归到10个26位位置上并进位
+        sums = np.zeros((groups, 10), dtype=np.uint64)
+        for a in range(5):
+            sums[:, a:a + 5] += products[:, a, :]
+        for j in range(9):
+            sums[:, j + 1] += sums[:, j] >> np.uint64(26)
+            sums[:, j] &= LIMB_MASK
+        r_batch = self._r_batch
+        mask = (1 << 130) - 1
+        for l in sums.tolist():
+            accumulator = accumulator * r_batch + (
+                l[0] | l[1] << 26 | l[2] << 52 | l[3] << 78 | l[4] << 104
+                | l[5] << 130 | l[6] << 156 | l[7] << 182 | l[8] << 208 | l[9] << 234)
+            accumulator = (accumulator & mask) + 5 * (accumulator >> 130)
+        return accumulator
+
+    def _blocks(self, data):
+        """处理若干完整的16字节块"""
+        accumulator = self.accumulator
+        batched = len(data) // (16 * POLY1305_BATCH) * (16 * POLY1305_BATCH)
+        # 分段处理，使临时分量数组的大小与输入长度无关
+        step = 16 * POLY1305_BATCH * 512
+        for start in range(0, batched, step):
+            accumulator = self._batched(data[start:min(start + step, batched)], accumulator)
+        r = self.r
+        mask = (1 << 130) - 1
+        for i in range(batched, len(data), 16):
+            accumulator = (accumulator + (int.from_bytes(data[i:i+16], 'little') | (1 << 128))) * r
+            accumulator = (accumulator & mask) + 5 * (accumulator >> 130)
+        self.accumulator = accumulator
+
+    def update(self, data):
+        data = memoryview(data).cast('B')
+        if self._buffer:
+            take = min(16 - len(self._buffer), len(data))
+            self._buffer += data[:take]
+            data = data[take:]
+            if len(self._buffer) < 16:
+                return
+            self._blocks(self._buffer)
+            self._buffer.clear()
+        full = len(data) // 16 * 16
+        self._blocks(data[:full])
+        self._buffer += data[full:]
+
+    def pad16(self):
+        """用零补齐当前的16字节块（AEAD构造中的填充）"""
+        if self._buffer:
+            self._buffer += b'\x00' * (16 - len(self._buffer))
+            self._blocks(self._buffer)
+            self._buffer.clear()
+
+    def finalize(self):
+        accumulator = self.accumulator
+        if self._buffer:
+            accumulator = (accumulator + int.from_bytes(self._buffer + b'\x01', 'little')) * self.r
+            self._buffer.clear()
+        accumulator = (accumulator % POLY1305_P + self.s) % (1 << 128)
+        return accumulator.to_bytes(16, 'little')
+
 def poly1305_mac(key, message):
     """生成Poly1305消息认证码"""
-    r = int.from_bytes(key[:16], 'little') & 0x0ffffffc0ffffffc0ffffffc0fffffff
-    s = int.from_bytes(key[16:], 'little')
-    accumulator = 0
-    p = (1 << 130) - 5
-    for i in range(0, len(message), 16):
-        n = int.from_bytes(message[i:i+16] + b'\x01', 'little')
-        accumulator = (accumulator + n) % p
-        accumulator = (accumulator * r) % p
-    accumulator = (accumulator + s) % (1 << 128)
-    return accumulator.to_bytes(16, 'little')
+    mac = Poly1305(key)
+    mac.update(message)
+    return mac.finalize()
 # ------------------ 加密和解密函数 ------------------
+def _aead_mac(key, nonce, associated_data):
+    """生成一次性Poly1305密钥并吸收填充后的附加数据"""
+    mac_key = chacha20_keystream(key, 0, nonce, 1)[:32].tobytes()
+    mac = Poly1305(mac_key)
+    mac.update(associated_data)
+    mac.pad16()
+    return mac
+
+def _aead_tag(mac, aad_length, ciphertext_length):
+    mac.pad16()
+    mac.update(aad_length.to_bytes(8, 'little') + ciphertext_length.to_bytes(8, 'little'))
+    return mac.finalize()
+
+class ChaCha20Poly1305Encryptor:
+    """流式加密：多次update()后调用finalize()，认证标签保存在tag属性中"""
+    def __init__(self, key, nonce, associated_data=b''):
+        self._stream = ChaCha20Stream(key, 1, nonce)
+        self._mac = _aead_mac(key, nonce, associated_data)
+        self._aad_length = len(associated_data)
+        self._length = 0
+        self.tag = None
+
+    def update(self, plaintext):
+        if self.tag is not None:
+            raise ValueError("Encryptor already finalized")
+        ciphertext = self._stream.update(plaintext)
+        self._mac.update(ciphertext)
+        self._length += len(ciphertext)
+        return ciphertext
+
+    def finalize(self):
+        if self.tag is None:
+            self.tag = _aead_tag(self._mac, self._aad_length, self._length)
+        return b''
+
+class ChaCha20Poly1305Decryptor:
+    """流式解密：update()返回的明文在finalize()校验标签成功之前不可信"""
+    def __init__(self, key, nonce, tag, associated_data=b''):
+        self._stream = ChaCha20Stream(key, 1, nonce)
+        self._mac = _aead_mac(key, nonce, associated_data)
+        self._aad_length = len(associated_data)
+        self._length = 0
+        self._tag = tag
+        self._finalized = False
+
+    def update(self, ciphertext):
+        if self._finalized:
+            raise ValueError("Decryptor already finalized")
+        self._mac.update(ciphertext)
+        self._length += len(ciphertext)
+        return self._stream.update(ciphertext)
+
+    def finalize(self):
+        if not self._finalized:
+            self._finalized = True
+            expected_tag = _aead_tag(self._mac, self._aad_length, self._length)
+            if not hmac.compare_digest(expected_tag, self._tag):
+                raise ValueError("Invalid tag!")
+        return b''
+
 def encrypt(key, nonce, plaintext, associated_data):
     """加密数据并生成认证标签"""
-    ciphertext = chacha20_encrypt(key, 1, nonce, plaintext)
-    mac_key = chacha20_encrypt(key, 0, nonce, b'\x00' * 32)[:32]
-    mac_data = associated_data + b'\x00' * ((16 - len(associated_data) % 16) % 16)
-    mac_data += ciphertext + b'\x00' * ((16 - len(ciphertext) % 16) % 16)
-    mac_data += len(associated_data).to_bytes(8, 'little')
-    mac_data += len(ciphertext).to_bytes(8, 'little')
-    tag = poly1305_mac(mac_key, mac_data)
-    return ciphertext, tag
+    encryptor = ChaCha20Poly1305Encryptor(key, nonce, associated_data)
+    ciphertext = encryptor.update(plaintext)
+    encryptor.finalize()
+    return ciphertext, encryptor.tag
 
 
-def decrypt(key, nonce, ciphertext, associated_data, tag):
-    """验证认证标签并解密数据"""
-    mac_key = chacha20_encrypt(key, 0, nonce, b'\x00' * 32)[:32]
-    mac_data = associated_data + b'\x00' * ((16 - len(associated_data) % 16) % 16)
-    mac_data += ciphertext + b'\x00' * ((16 - len(ciphertext) % 16) % 16)
-    mac_data += len(associated_data).to_bytes(8, 'little')
-    mac_data += len(ciphertext).to_bytes(8, 'little')
-    expected_tag = poly1305_mac(mac_key, mac_data)
-    if expected_tag != tag:
+def verify(key, nonce, ciphertext, associated_data, tag):
+    """只校验认证标签，不解密"""
+    mac = _aead_mac(key, nonce, associated_data)
+    mac.update(ciphertext)
+    expected_tag = _aead_tag(mac, len(associated_data), len(ciphertext))
+    if not hmac.compare_digest(expected_tag, tag):
         raise ValueError("Invalid tag!")
 
+def decrypt(key, nonce, ciphertext, associated_data, tag):
+    """验证认证标签并解密数据"""
+    verify(key, nonce, ciphertext, associated_data, tag)
     return chacha20_encrypt(key, 1, nonce, ciphertext)
+
+def encrypt_in_place(key, nonce, buffer, associated_data):
+    """原地加密可写缓冲区（bytearray、mmap等），不复制数据，返回认证标签"""
+    chacha20_xor(key, 1, nonce, buffer, buffer)
+    mac = _aead_mac(key, nonce, associated_data)
+    mac.update(buffer)
+    return _aead_tag(mac, len(associated_data), len(buffer))
+
+def decrypt_in_place(key, nonce, buffer, associated_data, tag):
+    """先校验认证标签，通过后原地解密可写缓冲区"""
+    verify(key, nonce, buffer, associated_data, tag)
+    chacha20_xor(key, 1, nonce, buffer, buffer)
 # ------------------ 示例调用 ------------------
-# 生成密钥和nonce
-key = os.urandom(32)  # 生成一个随机的32字节密钥
-nonce = os.urandom(12)  # 生成一个随机的12字节nonce
-# 明文和附加数据
-plaintext = b"Hello, this is a secret message!"
-associated_data = b"header"
-# 加密
-ciphertext, tag = encrypt(key, nonce, plaintext, associated_data)
-print(f"Ciphertext: {ciphertext.hex()}")
-print(f"Tag: {tag.hex()}")
-
-# 解密
-try:
-    decrypted_text = decrypt(key, nonce, ciphertext, associated_data, tag)
-    print(f"Decrypted text: {decrypted_text.decode()}")
-except ValueError as e:
-    print("Decryption failed:", str(e))
+if __name__ == "__main__":
+    # 生成密钥和nonce
+    key = os.urandom(32)  # 生成一个随机的32字节密钥
+    nonce = os.urandom(12)  # 生成一个随机的12字节nonce
+    # 明文和附加数据
+    plaintext = b"Hello, this is a secret message!"
+    associated_data = b"header"
+    # 加密
+    ciphertext, tag = encrypt(key, nonce, plaintext, associated_data)
+    print(f"Ciphertext: {ciphertext.hex()}")
+    print(f"Tag: {tag.hex()}")
+
+    # 解密
+    try:
+        decrypted_text = decrypt(key, nonce, ciphertext, associated_data, tag)
+        print(f"Decrypted text: {decrypted_text.decode()}")
+    except ValueError as e:
+        print("Decryption failed:", str(e))
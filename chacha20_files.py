@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+import os
+import sys
+import mmap
+import struct
+import getpass
+import hashlib
+import argparse
+import contextlib
+import importlib.util
+from concurrent.futures import ProcessPoolExecutor
+
+# ------------------ 加载 chacha20-ploy1305.py ------------------
+# 文件名带连字符无法直接import，按路径加载
+_spec = importlib.util.spec_from_file_location(
+    "chacha20_poly1305",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "chacha20-ploy1305.py"),
+)
+chacha20_poly1305 = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(chacha20_poly1305)
+encrypt = chacha20_poly1305.encrypt
+decrypt = chacha20_poly1305.decrypt
+
+# ------------------ 容器格式 ------------------
+# 文件头：魔数(8) + scrypt盐(16) + 文件nonce(8) + 分块大小(4) + 明文长度(8)
+# 之后依次是每个分块的 密文 + 16字节标签，分块i的位置可直接算出，支持随机访问。
+# 分块i的nonce = 文件nonce + i（4字节小端），整个文件头作为每个分块的附加数据。
+MAGIC = b"CC20P1\x00\x00"
+HEADER = struct.Struct("<8s16s8sIQ")
+TAG_SIZE = 16
+CHUNK_SIZE = 1 << 20  # 默认分块大小 1 MiB
+SUFFIX = ".cc20"
+# 原地模式：数据文件被原地加密，文件头和各分块标签写在旁路文件 原文件名.tags 中
+MAGIC_IN_PLACE = b"CC20P1I\x00"
+SIDECAR_SUFFIX = ".tags"
+# 输出先写到 目标文件名.partial，全部分块成功后再改名，失败时只删除本次创建的临时文件
+PARTIAL_SUFFIX = ".partial"
+
+def derive_key(password, salt):
+    """用scrypt从密码派生32字节密钥"""
+    return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=2**14, r=8, p=1, dklen=32)
+
+def chunk_count(size, chunk_size):
+    """空文件也保留一个空分块，使文件头总能被认证"""
+    return max(1, (size + chunk_size - 1) // chunk_size)
+
+def chunk_nonce(file_nonce, index):
+    return file_nonce + index.to_bytes(4, 'little')
+
+def chunk_offset(index, chunk_size):
+    """分块i在容器文件中的起始位置"""
+    return HEADER.size + index * (chunk_size + TAG_SIZE)
+
+def container_size(size, chunk_size):
+    """明文长度为size时容器文件的总长度"""
+    n = chunk_count(size, chunk_size)
+    return chunk_offset(n - 1, chunk_size) + (size - (n - 1) * chunk_size) + TAG_SIZE
+
+def read_header(f, expected_magic=MAGIC):
+    header = f.read(HEADER.size)
+    if len(header) != HEADER.size:
+        raise ValueError("文件头不完整")
+    magic, salt, file_nonce, chunk_size, size = HEADER.unpack(header)
+    if magic != expected_magic:
+        raise ValueError("不是ChaCha20-Poly1305容器文件")
+    if chunk_size <= 0:
+        raise ValueError("文件头中的分块大小无效")
+    # 文件头在解密分块前未经认证，却决定了输出文件的预分配长度，先与容器长度核对
+    # （原地模式的长度由调用方对照数据文件和标签文件检查）
+    if magic == MAGIC and os.fstat(f.fileno()).st_size != container_size(size, chunk_size):
+        raise ValueError("文件长度与文件头不一致")
+    return header, salt, file_nonce, chunk_size, size
+
+# ------------------ 分块工作函数（在进程池中运行） ------------------
+def _seal_chunk(task):
+    src, dst, key, header, file_nonce, chunk_size, index = task
+    fd = os.open(src, os.O_RDONLY)
+    try:
+        plaintext = os.pread(fd, chunk_size, index * chunk_size)
+    finally:
+        os.close(fd)
+    ciphertext, tag = encrypt(key, chunk_nonce(file_nonce, index), plaintext, header)
+    fd = os.open(dst, os.O_WRONLY)
+    try:
+        os.pwrite(fd, ciphertext + tag, chunk_offset(index, chunk_size))
+    finally:
+        os.close(fd)
+
+def _open_chunk(task):
+    src, dst, key, header, file_nonce, chunk_size, index = task
+    size = HEADER.unpack(header)[4]
+    length = min(chunk_size, size - index * chunk_size)
+    fd = os.open(src, os.O_RDONLY)
+    try:
+        data = os.pread(fd, length + TAG_SIZE, chunk_offset(index, chunk_size))
+    finally:
+        os.close(fd)
+    if len(data) != length + TAG_SIZE:
+        raise ValueError("分块被截断")
+    plaintext = decrypt(key, chunk_nonce(file_nonce, index), data[:length], header, data[length:])
+    fd = os.open(dst, os.O_WRONLY)
+    try:
+        os.pwrite(fd, plaintext, index * chunk_size)
+    finally:
+        os.close(fd)
+
+# ------------------ 原地模式工作函数 ------------------
+@contextlib.contextmanager
+def _mapped_chunk(path, header, index, writable):
+    """把分块映射到内存，处理完即刷盘并解除映射，常驻内存与文件大小无关"""
+    chunk_size, size = HEADER.unpack(header)[3:]
+    length = min(chunk_size, size - index * chunk_size)
+    if length == 0:
+        # 空文件无法mmap
+        yield bytearray()
+        return
+    access = mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ
+    with open(path, 'r+b' if writable else 'rb') as f, \
+            mmap.mmap(f.fileno(), length, offset=index * chunk_size, access=access) as mm:
+        yield mm
+        if writable:
+            mm.flush()
+
+def _seal_chunk_in_place(task):
+    path, key, header, file_nonce, index = task
+    with _mapped_chunk(path, header, index, True) as mm:
+        return chacha20_poly1305.encrypt_in_place(key, chunk_nonce(file_nonce, index), mm, header)
+
+def _verify_chunk_in_place(task):
+    path, key, header, file_nonce, index, tag = task
+    with _mapped_chunk(path, header, index, False) as mm:
+        chacha20_poly1305.verify(key, chunk_nonce(file_nonce, index), mm, header, tag)
+
+def _open_chunk_in_place(task):
+    path, key, header, file_nonce, index, tag = task
+    with _mapped_chunk(path, header, index, True) as mm:
+        chacha20_poly1305.chacha20_xor(key, 1, chunk_nonce(file_nonce, index), mm, mm)
+
+# ------------------ 任务准备 ------------------
+def _create_partial(dst, length, header=b''):
+    """独占创建临时输出文件并预分配长度；目标文件或同名临时文件已存在时拒绝，绝不覆盖"""
+    if os.path.exists(dst):
+        raise FileExistsError(f"目标文件已存在: {dst}")
+    tmp = dst + PARTIAL_SUFFIX
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(header)
+        f.truncate(length)
+    return tmp
+
+def _prepare_encrypt(src, password, chunk_size):
+    """写出文件头并预分配输出文件，返回该文件的全部分块任务"""
+    dst = src + SUFFIX
+    size = os.path.getsize(src)
+    salt = os.urandom(16)
+    file_nonce = os.urandom(8)
+    n = chunk_count(size, chunk_size)
+    if n > 1 << 32:
+        raise ValueError("文件过大，请增大分块大小")
+    header = HEADER.pack(MAGIC, salt, file_nonce, chunk_size, size)
+    key = derive_key(password, salt)
+    tmp = _create_partial(dst, container_size(size, chunk_size), header)
+    return dst, tmp, [(src, tmp, key, header, file_nonce, chunk_size, i) for i in range(n)]
+
+def _prepare_decrypt(src, password):
+    dst = src[:-len(SUFFIX)] if src.endswith(SUFFIX) else src + ".dec"
+    with open(src, 'rb') as f:
+        header, salt, file_nonce, chunk_size, size = read_header(f)
+    key = derive_key(password, salt)
+    n = chunk_count(size, chunk_size)
+    tmp = _create_partial(dst, size)
+    return dst, tmp, [(src, tmp, key, header, file_nonce, chunk_size, i) for i in range(n)]
+
+def _run(files, prepare, worker, workers):
+    """把所有文件的分块一起提交到进程池，按文件汇报结果；成功后把临时文件改名为目标文件并删除源文件"""
+    jobs = []
+    try:
+        for src in files:
+            try:
+                dst, tmp, tasks = prepare(src)
+            except Exception as e:
+                # 单个文件出错（包括损坏的文件头）不影响其余文件
+                print(f"跳过: {src} ({e})")
+                continue
+            jobs.append((src, dst, tmp, tasks))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            submitted = [(src, dst, tmp, [pool.submit(worker, t) for t in tasks]) for src, dst, tmp, tasks in jobs]
+            for src, dst, tmp, futures in submitted:
+                errors = [e for e in (f.exception() for f in futures) if e is not None]
+                if errors:
+                    os.remove(tmp)
+                    print(f"失败: {src} ({errors[0]})")
+                else:
+                    os.replace(tmp, dst)
+                    os.remove(src)
+                    print(f"完成: {src} -> {dst}")
+    finally:
+        # 中途退出（如Ctrl+C）时删除本次已创建但尚未改名的临时文件
+        for _, _, tmp, _ in jobs:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(tmp)
+
+def _collect(path, encrypted):
+    """收集目录下需要处理的文件"""
+    if os.path.isfile(path):
+        return [path]
+    files = []
+    for root, _, names in os.walk(path):
+        for name in names:
+            if name.endswith(PARTIAL_SUFFIX):
+                continue
+            if name.endswith(SUFFIX) == encrypted:
+                files.append(os.path.join(root, name))
+    return files
+
+def _collect_in_place(path, encrypted):
+    """原地模式下以旁路标签文件是否存在区分已加密和未加密的文件"""
+    if os.path.isfile(path):
+        candidates = [path]
+    else:
+        candidates = [os.path.join(root, name) for root, _, names in os.walk(path) for name in names]
+    files = []
+    for name in candidates:
+        if name.endswith((SIDECAR_SUFFIX, SUFFIX, PARTIAL_SUFFIX)):
+            continue
+        if os.path.exists(name + SIDECAR_SUFFIX) == encrypted:
+            files.append(name)
+    return files
+
+# ------------------ 对外接口 ------------------
+def encrypt_files(path, password, chunk_size=CHUNK_SIZE, workers=None):
+    """并行加密文件或目录下的所有文件，输出为 原文件名.cc20"""
+    if not 0 < chunk_size < 1 << 32:
+        raise ValueError("分块大小必须在 1 到 2**32-1 字节之间")
+    _run(_collect(path, False), lambda src: _prepare_encrypt(src, password, chunk_size), _seal_chunk, workers)
+
+def decrypt_files(path, password, workers=None):
+    """并行解密文件或目录下的所有 .cc20 文件"""
+    _run(_collect(path, True), lambda src: _prepare_decrypt(src, password), _open_chunk, workers)
+
+def decrypt_chunk(path, password, index):
+    """只读取并解密单个分块，不需要读取整个文件"""
+    with open(path, 'rb') as f:
+        header, salt, file_nonce, chunk_size, size = read_header(f)
+        if not 0 <= index < chunk_count(size, chunk_size):
+            raise IndexError("分块编号超出范围")
+        length = min(chunk_size, size - index * chunk_size)
+        f.seek(chunk_offset(index, chunk_size))
+        data = f.read(length + TAG_SIZE)
+    if len(data) != length + TAG_SIZE:
+        raise ValueError("分块被截断")
+    key = derive_key(password, salt)
+    return decrypt(key, chunk_nonce(file_nonce, index), data[:length], header, data[length:])
+
+def encrypt_files_in_place(path, password, chunk_size=CHUNK_SIZE, workers=None):
+    """通过mmap原地加密文件，不产生临时副本；标签写入 原文件名.tags"""
+    if not 0 < chunk_size < 1 << 32:
+        raise ValueError("分块大小必须在 1 到 2**32-1 字节之间")
+    if chunk_size % mmap.ALLOCATIONGRANULARITY:
+        raise ValueError(f"原地模式的分块大小必须是 {mmap.ALLOCATIONGRANULARITY} 的整数倍")
+    jobs = []
+    for src in _collect_in_place(path, False):
+        sidecar = src + SIDECAR_SUFFIX
+        size = os.path.getsize(src)
+        salt = os.urandom(16)
+        file_nonce = os.urandom(8)
+        n = chunk_count(size, chunk_size)
+        header = HEADER.pack(MAGIC_IN_PLACE, salt, file_nonce, chunk_size, size)
+        key = derive_key(password, salt)
+        # 先写出文件头，即使中途中断也保留了恢复所需的参数
+        with open(sidecar, 'wb') as f:
+            f.write(header)
+            f.truncate(HEADER.size + n * TAG_SIZE)
+        jobs.append((src, sidecar, [(src, key, header, file_nonce, i) for i in range(n)]))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        submitted = [(src, sidecar, [pool.submit(_seal_chunk_in_place, t) for t in tasks])
+                     for src, sidecar, tasks in jobs]
+        for (src, sidecar, futures), (_, _, tasks) in zip(submitted, jobs):
+            errors = [e for e in (f.exception() for f in futures) if e is not None]
+            if errors:
+                # 流密码异或两次即复原：把已加密的分块解回明文，再删除全零标签的旁路文件，
+                # 否则文件处于半加密状态且无法用标签解密
+                sealed = [t for t, f in zip(tasks, futures) if f.exception() is None]
+                reverted = [pool.submit(_open_chunk_in_place, t + (None,)) for t in sealed]
+                revert_errors = [e for e in (f.exception() for f in reverted) if e is not None]
+                if revert_errors:
+                    print(f"失败且无法恢复: {src} ({errors[0]}; {revert_errors[0]})，保留 {sidecar} 中的参数")
+                else:
+                    os.remove(sidecar)
+                    print(f"失败: {src} ({errors[0]})，已恢复原文件")
+                continue
+            tags = b''.join(f.result() for f in futures)
+            with open(sidecar, 'r+b') as f:
+                f.seek(HEADER.size)
+                f.write(tags)
+            print(f"完成: {src} (标签: {sidecar})")
+
+def decrypt_files_in_place(path, password, workers=None):
+    """先校验全部分块的标签，全部通过后再原地解密，避免留下半解密的文件"""
+    jobs = []
+    for src in _collect_in_place(path, True):
+        sidecar = src + SIDECAR_SUFFIX
+        try:
+            with open(sidecar, 'rb') as f:
+                header, salt, file_nonce, chunk_size, size = read_header(f, MAGIC_IN_PLACE)
+                tags = f.read()
+            n = chunk_count(size, chunk_size)
+            if len(tags) != n * TAG_SIZE or os.path.getsize(src) != size:
+                raise ValueError("文件长度与标签文件不一致")
+        except (OSError, ValueError) as e:
+            print(f"跳过: {src} ({e})")
+            continue
+        key = derive_key(password, salt)
+        tasks = [(src, key, header, file_nonce, i, tags[i * TAG_SIZE:(i + 1) * TAG_SIZE]) for i in range(n)]
+        jobs.append((src, sidecar, tasks))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        verified = [(job, [pool.submit(_verify_chunk_in_place, t) for t in job[2]]) for job in jobs]
+        passed = []
+        for job, futures in verified:
+            errors = [e for e in (f.exception() for f in futures) if e is not None]
+            if errors:
+                print(f"解密失败: {job[0]} ({errors[0]})")
+            else:
+                passed.append(job)
+        opened = [(src, sidecar, tasks, [pool.submit(_open_chunk_in_place, t) for t in tasks])
+                  for src, sidecar, tasks in passed]
+        for src, sidecar, tasks, futures in opened:
+            errors = [e for e in (f.exception() for f in futures) if e is not None]
+            if errors:
+                # 与加密时相同：再异或一次把已解密的分块恢复成密文，旁路文件中的标签仍然有效
+                done = [t for t, f in zip(tasks, futures) if f.exception() is None]
+                reverted = [pool.submit(_open_chunk_in_place, t) for t in done]
+                revert_errors = [e for e in (f.exception() for f in reverted) if e is not None]
+                if revert_errors:
+                    print(f"失败且无法恢复: {src} ({errors[0]}; {revert_errors[0]})，文件处于半解密状态")
+                else:
+                    print(f"失败: {src} ({errors[0]})，已恢复为加密状态")
+                continue
+            os.remove(sidecar)
+            print(f"完成: {src}")
+
+# ------------------ 命令行 ------------------
+def main():
+    parser = argparse.ArgumentParser(description="基于ChaCha20-Poly1305的分块并行文件加密")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("encrypt", help="加密文件或目录")
+    p.add_argument("path")
+    p.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    p.add_argument("-j", "--workers", type=int, default=None, help="进程数，默认为CPU核数")
+    p.add_argument("--in-place", action="store_true", help="通过mmap原地加密，标签写入 .tags 文件")
+    p = sub.add_parser("decrypt", help="解密文件或目录")
+    p.add_argument("path")
+    p.add_argument("-j", "--workers", type=int, default=None, help="进程数，默认为CPU核数")
+    p.add_argument("--in-place", action="store_true", help="原地解密由 --in-place 加密的文件")
+    p = sub.add_parser("chunk", help="解密单个分块并写到标准输出")
+    p.add_argument("path")
+    p.add_argument("index", type=int)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.path):
+        print("指定的路径不存在，请检查路径。")
+        sys.exit(1)
+    password = getpass.getpass("输入密码： ")
+    if args.command == "encrypt" and args.in_place:
+        encrypt_files_in_place(args.path, password, args.chunk_size, args.workers)
+    elif args.command == "encrypt":
+        encrypt_files(args.path, password, args.chunk_size, args.workers)
+    elif args.command == "decrypt" and args.in_place:
+        decrypt_files_in_place(args.path, password, args.workers)
+    elif args.command == "decrypt":
+        decrypt_files(args.path, password, args.workers)
+    else:
+        try:
+            sys.stdout.buffer.write(decrypt_chunk(args.path, password, args.index))
+        except (ValueError, IndexError) as e:
+            print(f"解密失败: {e}", file=sys.stderr)
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,14 @@
+import os
+import time
+import hmac
+import hashlib
 import secrets
+import struct
+import argparse
+import threading
+import queue
+import importlib.util
+from collections import namedtuple
 
 def gcd(a, b):
     while b != 0:
@@ -16,73 +26,485 @@ def mod_inverse(e, phi):
     if temp_phi == 1:
         return d + phi
 
-def is_prime(num):
-    if num <= 1:
-        return False
-    if num <= 3:
-        return True
-    if num % 2 == 0 or num % 3 == 0:
+# ---- 素数生成 ----
+def _small_primes(limit):
+    """埃氏筛，返回小于limit的奇素数"""
+    sieve = bytearray([1]) * limit
+    sieve[0:2] = b'\x00\x00'
+    for i in range(2, int(limit ** 0.5) + 1):
+        if sieve[i]:
+            sieve[i * i::i] = bytes(len(range(i * i, limit, i)))
+    return [i for i in range(3, limit) if sieve[i]]
+
+_small_prime_list = None
+
+def small_primes():
+    """小素数表在第一次生成素数时才计算，导入rsa.py不付出这部分开销"""
+    global _small_prime_list
+    if _small_prime_list is None:
+        _small_prime_list = _small_primes(1 << 15)
+    return _small_prime_list
+SIEVE_WINDOW = 4096  # 每个随机起点之后筛查的奇数个数
+
+def miller_rabin_rounds(bits):
+    """随机候选数的Miller-Rabin轮数（FIPS 186-4 表C.3，误判概率不超过2^-100）"""
+    if bits >= 1536:
+        return 3
+    if bits >= 1024:
+        return 4
+    if bits >= 512:
+        return 7
+    return 40
+
+def is_prime(num, rounds=40):
+    """先用小素数试除，再做rounds轮随机底数的Miller-Rabin"""
+    if num < 2:
         return False
-    i = 5
-    while i * i <= num:
-        if num % i == 0 or num % (i + 2) == 0:
+    for p in small_primes()[:64]:
+        if num % p == 0:
+            return num == p
+    if num % 2 == 0:
+        return num == 2
+    d = num - 1
+    r = 0
+    while d % 2 == 0:
+        d //= 2
+        r += 1
+    for _ in range(rounds):
+        a = secrets.randbelow(num - 3) + 2
+        x = pow(a, d, num)
+        if x == 1 or x == num - 1:
+            continue
+        for _ in range(r - 1):
+            x = x * x % num
+            if x == num - 1:
+                break
+        else:
             return False
-        i += 6
     return True
 
-def generate_large_prime(bits):
-    while True:
-        num = secrets.randbits(bits)
-        if is_prime(num):
-            return num
-
-def generate_keys(bits=2048):
-    print("Generating large prime numbers...")
-    p = generate_large_prime(bits // 2)
-    q = generate_large_prime(bits // 2)
-    print(f"Prime p: {p}")
-    print(f"Prime q: {q}")
-    
+def _search_window(bits):
+    """随机取一个最高两位为1的奇数起点，用小素数筛掉窗口内的合数后逐个做Miller-Rabin；窗口内没有素数时返回None"""
+    base = secrets.randbits(bits) | (3 << (bits - 2)) | 1
+    sieve = bytearray([1]) * SIEVE_WINDOW  # 下标i对应 base + 2*i
+    for p in small_primes():
+        if p >= base:
+            break
+        # base + 2i ≡ 0 (mod p)  =>  i ≡ -base * 2^-1 (mod p)
+        start = (-base * ((p + 1) // 2)) % p
+        sieve[start::p] = bytes(len(range(start, SIEVE_WINDOW, p)))
+    rounds = miller_rabin_rounds(bits)
+    for i in range(SIEVE_WINDOW):
+        if sieve[i]:
+            candidate = base + 2 * i
+            if candidate.bit_length() != bits:
+                return None
+            if is_prime(candidate, rounds):
+                return candidate
+    return None
+
+_stop_search = None
+
+def _init_search_worker(stop):
+    global _stop_search
+    _stop_search = stop
+
+def _search_worker(bits):
+    while not _stop_search.is_set():
+        prime = _search_window(bits)
+        if prime is not None:
+            _stop_search.set()
+            return prime
+    return None
+
+def generate_large_prime(bits, workers=1):
+    """生成恰好bits位的素数（最高两位为1，两个这样的素数相乘恰好是2*bits位）；
+    workers > 1 时多个进程同时搜索，返回最先找到的素数"""
+    if bits < 16:
+        raise ValueError("素数位数太小")
+    if workers <= 1:
+        while True:
+            prime = _search_window(bits)
+            if prime is not None:
+                return prime
+    # 多进程只在并行搜索时才导入，避免拖慢导入rsa.py
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    stop = multiprocessing.Event()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_search_worker, initargs=(stop,)) as pool:
+        futures = [pool.submit(_search_worker, bits) for _ in range(workers)]
+        for future in as_completed(futures):
+            prime = future.result()
+            if prime is not None:
+                stop.set()
+                return prime
+
+# ---- 密钥 ----
+PublicKey = namedtuple("PublicKey", "e n")
+# 私钥保留p、q和CRT参数：dp = d mod (p-1)，dq = d mod (q-1)，qinv = q^-1 mod p
+PrivateKey = namedtuple("PrivateKey", "n e d p q dp dq qinv")
+
+def private_key_from_primes(p, q, e=65537):
     n = p * q
     phi = (p - 1) * (q - 1)
-    e = 65537  # 常用的公钥指数
     d = mod_inverse(e, phi)
-    
-    print(f"Modulus n: {n}")
-    print(f"Euler's Totient phi: {phi}")
-    print(f"Public exponent e: {e}")
-    print(f"Private exponent d: {d}")
-    
-    return ((e, n), (d, n))
+    if d is None:
+        raise ValueError("e与(p-1)(q-1)不互素")
+    return PrivateKey(n, e, d, p, q, d % (p - 1), d % (q - 1), pow(q, -1, p))
+
+def generate_keys(bits=2048, workers=1):
+    """返回(PublicKey, PrivateKey)"""
+    e = 65537  # 常用的公钥指数
+    # e必须与p-1、q-1互素，否则d不存在
+    while True:
+        p = generate_large_prime(bits // 2, workers)
+        if gcd(e, p - 1) == 1:
+            break
+    while True:
+        q = generate_large_prime(bits // 2, workers)
+        if q != p and gcd(e, q - 1) == 1:
+            break
+    private_key = private_key_from_primes(p, q, e)
+    return PublicKey(e, private_key.n), private_key
 
 def encrypt(public_key, plaintext):
     e, n = public_key
-    ciphertext = pow(plaintext, e, n)
-    print(f"Encrypting message {plaintext} to ciphertext {ciphertext}")
-    return ciphertext
+    return pow(plaintext, e, n)
+
+def _private_op(private_key, value):
+    """m = value^d mod n；PrivateKey走CRT，两次半长模幂代替一次全长模幂，约快3-4倍；
+    兼容旧的(d, n)元组"""
+    if not isinstance(private_key, PrivateKey):
+        d, n = private_key
+        return pow(value, d, n)
+    m1 = pow(value, private_key.dp, private_key.p)
+    m2 = pow(value, private_key.dq, private_key.q)
+    h = private_key.qinv * (m1 - m2) % private_key.p
+    return m2 + h * private_key.q
 
 def decrypt(private_key, ciphertext):
-    d, n = private_key
-    decrypted_message = pow(ciphertext, d, n)
-    print(f"Decrypting ciphertext {ciphertext} to message {decrypted_message}")
-    return decrypted_message
+    return _private_op(private_key, ciphertext)
+
+def sign(private_key, message):
+    """对整数message做RSA签名；用公钥验算一次，防止CRT计算出错时泄露p、q（Bellcore攻击）"""
+    signature = _private_op(private_key, message)
+    if isinstance(private_key, PrivateKey) and pow(signature, private_key.e, private_key.n) != message % private_key.n:
+        raise ValueError("签名验算失败")
+    return signature
+
+def verify(public_key, message, signature):
+    e, n = public_key
+    return pow(signature, e, n) == message % n
+
+def decrypt_batch(private_key, ciphertexts):
+    """批量解密，所有密文共用同一组CRT参数"""
+    return [_private_op(private_key, c) for c in ciphertexts]
+
+def sign_batch(private_key, messages):
+    return [sign(private_key, m) for m in messages]
+
+# ---- 密钥文件 ----
+# 紧凑的二进制格式：魔数(8) + 字段数(2)，之后每个整数为 长度(2) + 大端字节；
+# 私钥依次保存 n e d p q dp dq qinv，公钥保存 e n。加载时不需要做任何模运算
+KEY_MAGIC_PRIVATE = b"RSAPRIV1"
+KEY_MAGIC_PUBLIC = b"RSAPUB1\0"
+KEY_HEADER = struct.Struct(">8sH")
+_key_cache = {}
+
+def _pack_key(magic, values):
+    parts = [KEY_HEADER.pack(magic, len(values))]
+    for value in values:
+        raw = value.to_bytes((value.bit_length() + 7) // 8 or 1, 'big')
+        parts.append(len(raw).to_bytes(2, 'big') + raw)
+    return b"".join(parts)
+
+def _unpack_key(data):
+    magic, count = KEY_HEADER.unpack_from(data)
+    offset = KEY_HEADER.size
+    values = []
+    for _ in range(count):
+        length = int.from_bytes(data[offset:offset + 2], 'big')
+        values.append(int.from_bytes(data[offset + 2:offset + 2 + length], 'big'))
+        offset += 2 + length
+    if offset != len(data):
+        raise ValueError("密钥文件长度不正确")
+    if magic == KEY_MAGIC_PRIVATE and count == len(PrivateKey._fields):
+        return PrivateKey(*values)
+    if magic == KEY_MAGIC_PUBLIC and count == len(PublicKey._fields):
+        return PublicKey(*values)
+    raise ValueError("不是rsa.py的密钥文件")
+
+def serialize_key(key):
+    magic = KEY_MAGIC_PRIVATE if isinstance(key, PrivateKey) else KEY_MAGIC_PUBLIC
+    return _pack_key(magic, list(key))
+
+def deserialize_key(data):
+    return _unpack_key(bytes(data))
+
+def _write_file_atomic(path, data, mode):
+    """先写临时文件再改名，读取方不会看到写了一半的密钥"""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+    with open(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+def save_key(path, key):
+    """私钥文件只允许当前用户读写"""
+    _write_file_atomic(path, serialize_key(key), 0o600 if isinstance(key, PrivateKey) else 0o644)
+
+def load_key(path):
+    """加载密钥文件；同一进程内按(路径, 修改时间, 大小)缓存，文件不变时不再读盘"""
+    st = os.stat(path)
+    cache_key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+    key = _key_cache.get(cache_key)
+    if key is None:
+        with open(path, "rb") as f:
+            key = _unpack_key(f.read())
+        _key_cache[cache_key] = key
+    return key
+
+def public_key_of(private_key):
+    return PublicKey(private_key.e, private_key.n)
+
+def load_or_generate_keys(path, bits=2048):
+    """密钥文件存在就直接加载，否则生成并保存；返回(PublicKey, PrivateKey)"""
+    try:
+        private_key = load_key(path)
+    except FileNotFoundError:
+        private_key = generate_keys(bits)[1]
+        save_key(path, private_key)
+    return public_key_of(private_key), private_key
+
+# ---- 密钥池 ----
+class KeyPool:
+    """进程内密钥池：后台线程预先生成密钥，get()在池中有存货时立即返回"""
+    def __init__(self, bits=2048, size=4):
+        self.bits = bits
+        self._keys = queue.Queue(size)
+        self._thread = threading.Thread(target=self._fill, name="rsa-keypool", daemon=True)
+        self._thread.start()
+
+    def _fill(self):
+        while True:
+            self._keys.put(generate_keys(self.bits))
+
+    def get(self, timeout=None):
+        """返回(PublicKey, PrivateKey)；池空时等待后台线程生成"""
+        return self._keys.get(timeout=timeout)
+
+KEYPOOL_SUFFIX = ".key"
+
+def take_pooled_key(directory):
+    """从keypool守护进程维护的目录里领取一把私钥：改名即占有，多个进程同时领取也不会拿到同一把；
+    目录为空时返回None"""
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(KEYPOOL_SUFFIX):
+            continue
+        path = os.path.join(directory, name)
+        claimed = f"{path}.{os.getpid()}.claimed"
+        try:
+            os.rename(path, claimed)
+        except FileNotFoundError:
+            continue
+        try:
+            with open(claimed, "rb") as f:
+                private_key = _unpack_key(f.read())
+        finally:
+            os.remove(claimed)
+        return public_key_of(private_key), private_key
+    return None
+
+def run_keypool(directory, size=8, bits=2048, interval=1.0):
+    """守护进程：保持目录中有size把已生成的私钥，被领走后立即补上"""
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    while True:
+        ready = [name for name in os.listdir(directory) if name.endswith(KEYPOOL_SUFFIX)]
+        if len(ready) >= size:
+            time.sleep(interval)
+            continue
+        private_key = generate_keys(bits)[1]
+        name = f"{time.time_ns()}-{secrets.token_hex(4)}{KEYPOOL_SUFFIX}"
+        _write_file_atomic(os.path.join(directory, name), serialize_key(private_key), 0o600)
+
+# ---- OAEP（RFC 8017，SHA-256 + MGF1-SHA256）----
+OAEP_HASH_LEN = 32
+
+def _xor_bytes(a, b):
+    return (int.from_bytes(a, 'big') ^ int.from_bytes(b, 'big')).to_bytes(len(a), 'big')
+
+def _mgf1(seed, length):
+    output = bytearray()
+    counter = 0
+    while len(output) < length:
+        output += hashlib.sha256(seed + counter.to_bytes(4, 'big')).digest()
+        counter += 1
+    return bytes(output[:length])
+
+def modulus_bytes(key):
+    return (key.n.bit_length() + 7) // 8
+
+def oaep_max_length(public_key):
+    """单个RSA块最多能加密的字节数，2048位密钥为190字节"""
+    return modulus_bytes(public_key) - 2 * OAEP_HASH_LEN - 2
+
+def oaep_encrypt(public_key, message, label=b''):
+    k = modulus_bytes(public_key)
+    if len(message) > oaep_max_length(public_key):
+        raise ValueError(f"消息过长，最多 {oaep_max_length(public_key)} 字节")
+    label_hash = hashlib.sha256(label).digest()
+    padding = b'\x00' * (k - len(message) - 2 * OAEP_HASH_LEN - 2)
+    db = label_hash + padding + b'\x01' + message
+    seed = secrets.token_bytes(OAEP_HASH_LEN)
+    masked_db = _xor_bytes(db, _mgf1(seed, k - OAEP_HASH_LEN - 1))
+    masked_seed = _xor_bytes(seed, _mgf1(masked_db, OAEP_HASH_LEN))
+    em = b'\x00' + masked_seed + masked_db
+    return encrypt(public_key, int.from_bytes(em, 'big')).to_bytes(k, 'big')
+
+def oaep_decrypt(private_key, ciphertext, label=b''):
+    """所有格式错误都报同一个异常，不区分失败原因"""
+    k = modulus_bytes(private_key)
+    c = int.from_bytes(ciphertext, 'big')
+    if len(ciphertext) != k or c >= private_key.n:
+        raise ValueError("OAEP解密失败")
+    em = _private_op(private_key, c).to_bytes(k, 'big')
+    masked_seed = em[1:1 + OAEP_HASH_LEN]
+    masked_db = em[1 + OAEP_HASH_LEN:]
+    seed = _xor_bytes(masked_seed, _mgf1(masked_db, OAEP_HASH_LEN))
+    db = _xor_bytes(masked_db, _mgf1(seed, k - OAEP_HASH_LEN - 1))
+    separator = db.find(b'\x01', OAEP_HASH_LEN)
+    valid = em[0] == 0
+    valid &= hmac.compare_digest(db[:OAEP_HASH_LEN], hashlib.sha256(label).digest())
+    valid &= separator >= 0 and not any(db[OAEP_HASH_LEN:separator])
+    if not valid:
+        raise ValueError("OAEP解密失败")
+    return db[separator + 1:]
+
+# ---- 混合加密 ----
+# RSA-OAEP只加密一个随机的32字节ChaCha20-Poly1305密钥，数据本身用对称加密，长度不受模数限制。
+# 格式：OAEP(密钥) + nonce(12) + 标签(16) + 密文，OAEP部分同时作为附加数据参与认证
+HYBRID_NONCE_SIZE = 12
+HYBRID_TAG_SIZE = 16
+_chacha20_poly1305 = None
+
+def _aead():
+    """按需加载 chacha20-ploy1305.py（文件名带连字符，按路径加载；依赖numpy，不在导入rsa时加载）"""
+    global _chacha20_poly1305
+    if _chacha20_poly1305 is None:
+        spec = importlib.util.spec_from_file_location(
+            "chacha20_poly1305",
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), "chacha20-ploy1305.py"),
+        )
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _chacha20_poly1305 = module
+    return _chacha20_poly1305
+
+def hybrid_encrypt(public_key, plaintext, associated_data=b''):
+    key = secrets.token_bytes(32)
+    nonce = secrets.token_bytes(HYBRID_NONCE_SIZE)
+    wrapped = oaep_encrypt(public_key, key)
+    ciphertext, tag = _aead().encrypt(key, nonce, plaintext, wrapped + associated_data)
+    return wrapped + nonce + tag + ciphertext
+
+def hybrid_decrypt(private_key, data, associated_data=b''):
+    k = modulus_bytes(private_key)
+    if len(data) < k + HYBRID_NONCE_SIZE + HYBRID_TAG_SIZE:
+        raise ValueError("数据长度不足")
+    wrapped = data[:k]
+    nonce = data[k:k + HYBRID_NONCE_SIZE]
+    tag = data[k + HYBRID_NONCE_SIZE:k + HYBRID_NONCE_SIZE + HYBRID_TAG_SIZE]
+    key = oaep_decrypt(private_key, wrapped)
+    return _aead().decrypt(key, nonce, data[k + HYBRID_NONCE_SIZE + HYBRID_TAG_SIZE:], wrapped + associated_data, tag)
+
+def benchmark(bits=2048, count=200):
+    public_key, private_key = generate_keys(bits)
+    ciphertexts = [encrypt(public_key, secrets.randbelow(public_key.n)) for _ in range(count)]
+    start = time.perf_counter()
+    plain = [pow(c, private_key.d, private_key.n) for c in ciphertexts]
+    full = count / (time.perf_counter() - start)
+    start = time.perf_counter()
+    if decrypt_batch(private_key, ciphertexts) != plain:
+        raise ValueError("CRT解密结果不一致")
+    crt = count / (time.perf_counter() - start)
+    print(f"{bits}位私钥运算: 完整模幂 {full:,.0f} 次/秒，CRT {crt:,.0f} 次/秒（{crt / full:.1f}倍）")
+
+def benchmark_hybrid(bits=2048, size=1 << 20, block_sample=64 << 10):
+    """比较每MB数据的加解密耗时：混合模式 vs 按模数切块逐块OAEP（逐块只测block_sample字节再折算）"""
+    public_key, private_key = generate_keys(bits)
+    data = secrets.token_bytes(size)
+    _aead()
+    start = time.perf_counter()
+    sealed = hybrid_encrypt(public_key, data)
+    middle = time.perf_counter()
+    if hybrid_decrypt(private_key, sealed) != data:
+        raise ValueError("混合模式解密结果不一致")
+    end = time.perf_counter()
+    scale = (1 << 20) / size
+    print(f"混合模式: 加密 {(middle - start) * scale * 1000:.0f} ms/MB，解密 {(end - middle) * scale * 1000:.0f} ms/MB，"
+          f"额外开销 {len(sealed) - size} 字节")
+    block = oaep_max_length(public_key)
+    sample = data[:block_sample]
+    start = time.perf_counter()
+    blocks = [oaep_encrypt(public_key, sample[i:i + block]) for i in range(0, len(sample), block)]
+    middle = time.perf_counter()
+    if b"".join(oaep_decrypt(private_key, c) for c in blocks) != sample:
+        raise ValueError("逐块解密结果不一致")
+    end = time.perf_counter()
+    scale = (1 << 20) / len(sample)
+    print(f"逐块RSA（{block}字节/块）: 加密 {(middle - start) * scale * 1000:.0f} ms/MB，"
+          f"解密 {(end - middle) * scale * 1000:.0f} ms/MB，密文膨胀 {modulus_bytes(public_key) / block:.2f} 倍")
+
+def demo(key_file=None, bits=2048):
+    # 生成密钥对（指定密钥文件时复用已保存的密钥）
+    if key_file:
+        public_key, private_key = load_or_generate_keys(key_file, bits)
+    else:
+        public_key, private_key = generate_keys(bits=bits)
+    print(f"{public_key.n.bit_length()} 位密钥，e = {public_key.e}")
 
-# 参数设置
-key_size = 2048  # 密钥大小（位数）
+    # 示例消息
+    message = 42
 
-# 生成密钥对
-public_key, private_key = generate_keys(bits=key_size)
+    # 加密消息
+    ciphertext = encrypt(public_key, message)
 
-# 示例消息
-message = 42
+    # 解密消息
+    decrypted_message = decrypt(private_key, ciphertext)
 
-# 加密消息
-ciphertext = encrypt(public_key, message)
+    # 输出结果
+    print("Original message:", message)
+    print("Encrypted message:", hex(ciphertext)[:34] + "...")
+    print("Decrypted message:", decrypted_message)
 
-# 解密消息
-decrypted_message = decrypt(private_key, ciphertext)
+def main():
+    parser = argparse.ArgumentParser(description="教学用RSA：密钥生成、OAEP、混合加密")
+    sub = parser.add_subparsers(dest="command")
+    p = sub.add_parser("demo", help="加密并解密一个示例整数（默认）")
+    p.add_argument("--key-file", help="密钥文件，不存在时生成并保存")
+    p.add_argument("--bits", type=int, default=2048)
+    p = sub.add_parser("genkey", help="生成私钥文件")
+    p.add_argument("path")
+    p.add_argument("--bits", type=int, default=2048)
+    p.add_argument("-j", "--workers", type=int, default=1, help="并行搜索素数的进程数")
+    p = sub.add_parser("keypool", help="守护进程：在目录中保持一定数量的预生成私钥")
+    p.add_argument("directory")
+    p.add_argument("--size", type=int, default=8)
+    p.add_argument("--bits", type=int, default=2048)
+    sub.add_parser("benchmark", help="CRT和混合加密的性能测试")
+    args = parser.parse_args()
+    if args.command == "genkey":
+        save_key(args.path, generate_keys(args.bits, args.workers)[1])
+        print(f"已保存 {args.bits} 位私钥到 {args.path}")
+    elif args.command == "keypool":
+        run_keypool(args.directory, args.size, args.bits)
+    elif args.command == "benchmark":
+        benchmark()
+        benchmark_hybrid()
+    elif args.command == "demo":
+        demo(args.key_file, args.bits)
+    else:
+        demo()
 
-# 输出结果
-print("Original message:", message)
-print("Encrypted message:", ciphertext)
-print("Decrypted message:", decrypted_message)
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,16 @@
 import os
+import sys
+import csv
+import json
+import time
+import hmac
 import hashlib
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+# Bech32 编码（原先的函数名仍可从本模块导入）
+from bech32 import (bech32_polymod, bech32_hrp_expand, bech32_create_checksum, bech32_encode, convertbits,
+                    encode_segwit_address, encode_segwit_addresses)
 
 # secp256k1 相关常量
 P = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEFFFFFC2F
@@ -9,101 +20,434 @@ Gx = 0x79BE667EF9DCBBAC55A06295CE870B07029BFCDB2DCE28D959F2815B16F81798
 Gy = 0x483ADA7726A3C4655DA4FBFC0E1108A8FD17B448A68554199C47D08FFB10D4B8
 N = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEBAAEDCE6AF48A03BBFD25E8CD0364141
 
-# 椭圆曲线点加法
-def point_addition(P, Q):
-    if P is None:
-        return Q
-    if Q is None:
-        return P
-    if P == Q:
+G = (Gx, Gy)
+
+# 椭圆曲线点加法（仿射坐标，None表示无穷远点）
+def point_addition(p1, p2):
+    if p1 is None:
+        return p2
+    if p2 is None:
+        return p1
+    if p1[0] == p2[0] and (p1[1] + p2[1]) % P == 0:
+        # 互为相反点（包括y=0的点自加）
+        return None
+    if p1 == p2:
         # 计算斜率 lam = (3 * x^2 + a) / (2 * y) mod p
-        lam = (3 * P[0] * P[0] * pow(2 * P[1], P - 2, P)) % P
+        lam = (3 * p1[0] * p1[0] + A) * pow(2 * p1[1], -1, P) % P
     else:
         # 计算斜率 lam = (y2 - y1) / (x2 - x1) mod p
-        lam = ((Q[1] - P[1]) * pow(Q[0] - P[0], P - 2, P)) % P
+        lam = (p2[1] - p1[1]) * pow(p2[0] - p1[0], -1, P) % P
     # 计算 x3 和 y3
-    x = (lam * lam - P[0] - Q[0]) % P
-    y = (lam * (P[0] - x) - P[1]) % P
+    x = (lam * lam - p1[0] - p2[0]) % P
+    y = (lam * (p1[0] - x) - p1[1]) % P
     return (x, y)
 
-# 椭圆曲线点乘
-def scalar_multiplication(k, P):
-    R = None
+# ---- Jacobian坐标 ----
+# (X, Y, Z) 对应仿射点 (X/Z^2, Y/Z^3)，加法和倍点不需要求逆，只在最后转换回仿射坐标时求一次逆
+def to_jacobian(point):
+    return None if point is None else (point[0], point[1], 1)
+
+def to_affine(point):
+    if point is None:
+        return None
+    X, Y, Z = point
+    z_inv = pow(Z, -1, P)
+    z_inv2 = z_inv * z_inv % P
+    return (X * z_inv2 % P, Y * z_inv2 * z_inv % P)
+
+def jacobian_double(point):
+    """倍点，a = 0 时的公式"""
+    if point is None:
+        return None
+    X, Y, Z = point
+    if Y == 0:
+        return None
+    YY = Y * Y % P
+    S = 4 * X * YY % P
+    M = 3 * X * X % P
+    X3 = (M * M - 2 * S) % P
+    Y3 = (M * (S - X3) - 8 * YY * YY) % P
+    Z3 = 2 * Y * Z % P
+    return (X3, Y3, Z3)
+
+def jacobian_add(p1, p2):
+    """两个Jacobian点相加"""
+    if p1 is None:
+        return p2
+    if p2 is None:
+        return p1
+    X1, Y1, Z1 = p1
+    X2, Y2, Z2 = p2
+    Z1Z1 = Z1 * Z1 % P
+    Z2Z2 = Z2 * Z2 % P
+    U1 = X1 * Z2Z2 % P
+    U2 = X2 * Z1Z1 % P
+    S1 = Y1 * Z2 * Z2Z2 % P
+    S2 = Y2 * Z1 * Z1Z1 % P
+    if U1 == U2:
+        return jacobian_double(p1) if S1 == S2 else None
+    H = U2 - U1
+    R = S2 - S1
+    HH = H * H % P
+    HHH = H * HH % P
+    V = U1 * HH % P
+    X3 = (R * R - HHH - 2 * V) % P
+    Y3 = (R * (V - X3) - S1 * HHH) % P
+    Z3 = Z1 * Z2 * H % P
+    return (X3, Y3, Z3)
+
+def jacobian_add_affine(p1, p2):
+    """Jacobian点加仿射点（混合加法），比两个Jacobian点相加少几次乘法"""
+    if p2 is None:
+        return p1
+    if p1 is None:
+        return (p2[0], p2[1], 1)
+    X1, Y1, Z1 = p1
+    Z1Z1 = Z1 * Z1 % P
+    U2 = p2[0] * Z1Z1 % P
+    S2 = p2[1] * Z1 * Z1Z1 % P
+    H = U2 - X1
+    R = S2 - Y1
+    if H % P == 0:
+        return jacobian_double(p1) if R % P == 0 else None
+    HH = H * H % P
+    HHH = H * HH % P
+    V = X1 * HH % P
+    X3 = (R * R - HHH - 2 * V) % P
+    Y3 = (R * (V - X3) - Y1 * HHH) % P
+    Z3 = Z1 * H % P
+    return (X3, Y3, Z3)
+
+def batch_inverse(values, modulus=P):
+    """Montgomery批量求逆：n个数只做一次模逆和约3n次乘法；values中不能有0"""
+    prefix = []
+    acc = 1
+    for v in values:
+        prefix.append(acc)
+        acc = acc * v % modulus
+    inv = pow(acc, -1, modulus)
+    result = [0] * len(values)
+    for i in range(len(values) - 1, -1, -1):
+        result[i] = prefix[i] * inv % modulus
+        inv = inv * values[i] % modulus
+    return result
+
+def batch_to_affine(points):
+    """把一批Jacobian点一起转换为仿射坐标，只求一次逆；无穷远点保持为None"""
+    finite = [i for i, point in enumerate(points) if point is not None]
+    result = [None] * len(points)
+    if not finite:
+        return result
+    z_invs = batch_inverse([points[i][2] for i in finite])
+    for i, z_inv in zip(finite, z_invs):
+        X, Y, _ = points[i]
+        z_inv2 = z_inv * z_inv % P
+        result[i] = (X * z_inv2 % P, Y * z_inv2 * z_inv % P)
+    return result
+
+# ---- 基点G的定基窗口表 ----
+# 标量按8位切成32个窗口，第i个表存 j * 256^i * G（j = 1..255，仿射坐标）。
+# k*G 只需最多32次混合加法，不需要倍点；表约8000个点，首次使用时构建（约0.1秒）
+WINDOW_BITS = 8
+WINDOW_COUNT = (256 + WINDOW_BITS - 1) // WINDOW_BITS
+_g_table = None
+
+def _build_g_table():
+    table = []
+    base = G
+    for _ in range(WINDOW_COUNT):
+        multiples = []
+        acc = None
+        for _ in range((1 << WINDOW_BITS) - 1):
+            acc = jacobian_add_affine(acc, base)
+            multiples.append(acc)
+        multiples = batch_to_affine(multiples)
+        table.append(multiples)
+        # 下一个窗口的基点 = 256 * base
+        base = point_addition(multiples[-1], base)
+    return table
+
+def g_table():
+    global _g_table
+    if _g_table is None:
+        _g_table = _build_g_table()
+    return _g_table
+
+def fixed_base_multiply_jacobian(k):
+    """k*G，返回Jacobian坐标，便于批量转换"""
+    table = g_table()
+    k %= N
+    acc = None
+    mask = (1 << WINDOW_BITS) - 1
+    for window in table:
+        digit = k & mask
+        if digit:
+            acc = jacobian_add_affine(acc, window[digit - 1])
+        k >>= WINDOW_BITS
+    return acc
+
+def fixed_base_multiply(k):
+    return to_affine(fixed_base_multiply_jacobian(k))
+
+# ---- 任意点的wNAF标量乘法 ----
+WNAF_WIDTH = 5
+
+def wnaf(k, width=WNAF_WIDTH):
+    """宽度为width的非相邻形式，低位在前；非零位都是奇数且任意width个相邻位中最多一个非零"""
+    digits = []
+    modulus = 1 << width
     while k:
         if k & 1:
-            R = point_addition(R, P)
-        P = point_addition(P, P)
+            digit = k & (modulus - 1)
+            if digit >= modulus >> 1:
+                digit -= modulus
+            k -= digit
+        else:
+            digit = 0
+        digits.append(digit)
         k >>= 1
-    return R
+    return digits
+
+def odd_multiples(point, width=WNAF_WIDTH):
+    """[P, 3P, 5P, ..., (2^(width-1)-1)P]，仿射坐标"""
+    double = to_affine(jacobian_double(to_jacobian(point)))
+    multiples = [to_jacobian(point)]
+    for _ in range((1 << (width - 2)) - 1):
+        multiples.append(jacobian_add_affine(multiples[-1], double))
+    return batch_to_affine(multiples)
+
+def _odd_multiples_jacobian(point, width=WNAF_WIDTH):
+    """同odd_multiples，但不求逆，结果留给调用方和其他点一起批量转换"""
+    double = jacobian_double(to_jacobian(point))
+    multiples = [to_jacobian(point)]
+    for _ in range((1 << (width - 2)) - 1):
+        multiples.append(jacobian_add(multiples[-1], double))
+    return multiples
+
+def wnaf_multiply_jacobian(k, point, width=WNAF_WIDTH):
+    k %= N
+    if k == 0 or point is None:
+        return None
+    table = odd_multiples(point, width)
+    negated = [None if q is None else (q[0], P - q[1]) for q in table]
+    acc = None
+    for digit in reversed(wnaf(k, width)):
+        acc = jacobian_double(acc)
+        if digit > 0:
+            acc = jacobian_add_affine(acc, table[digit >> 1])
+        elif digit < 0:
+            acc = jacobian_add_affine(acc, negated[(-digit) >> 1])
+    return acc
+
+# 椭圆曲线点乘
+def scalar_multiplication(k, point):
+    """基点G走定基查表，其他点走wNAF"""
+    if point == G:
+        return fixed_base_multiply(k)
+    return to_affine(wnaf_multiply_jacobian(k, point))
 
-# 生成随机私钥
+# 生成随机私钥（1 <= k < N，拒绝采样避免取模带来的偏差）
 def generate_private_key():
-    return int.from_bytes(os.urandom(32), 'big') % N
+    while True:
+        k = int.from_bytes(os.urandom(32), 'big')
+        if 0 < k < N:
+            return k
 
 # 使用 secp256k1 曲线生成公钥
 def private_key_to_public_key(private_key):
-    return scalar_multiplication(private_key, (Gx, Gy))
+    return fixed_base_multiply(private_key)
+
+# 压缩格式公钥：02/03（y的奇偶）+ x
+def compress_public_key(public_key):
+    x, y = public_key
+    return bytes([2 + (y & 1)]) + x.to_bytes(32, 'big')
 
 # 计算公钥的哈希值
 def hash_public_key(public_key):
-    x, y = public_key
-    # 将公钥转换为字节
-    public_key_bytes = b'\x04' + x.to_bytes(32, 'big') + y.to_bytes(32, 'big')
+    # BIP84（P2WPKH）只接受压缩公钥，未压缩公钥的见证输出无法按标准规则花费
+    public_key_bytes = compress_public_key(public_key)
     # 计算 SHA-256 和 RIPEMD-160 哈希
     sha256 = hashlib.sha256(public_key_bytes).digest()
     ripemd160 = hashlib.new('ripemd160', sha256).digest()
     return ripemd160
 
-# Bech32 编码
-def bech32_polymod(values):
-    GEN = [0x3b6a57b2, 0x26508e6d, 0x1ea119fa, 0x3d4233dd, 0x2a1462b3]
-    chk = 1
-    for v in values:
-        b = (chk >> 25)
-        chk = ((chk & 0x1ffffff) << 5) ^ v
-        for i in range(5):
-            chk ^= GEN[i] if ((b >> i) & 1) else 0
-    return chk
-
-def bech32_hrp_expand(hrp):
-    return [ord(x) >> 5 for x in hrp] + [0] + [ord(x) & 31 for x in hrp]
-
-def bech32_create_checksum(hrp, data):
-    values = bech32_hrp_expand(hrp) + data
-    polymod = bech32_polymod(values + [0, 0, 0, 0, 0, 0]) ^ 1
-    return [(polymod >> 5 * (5 - i)) & 31 for i in range(6)]
-
-def bech32_encode(hrp, data):
-    CHARSET = 'qpzry9x8gf2tvdw0s3jn54khce6mua7l'
-    combined = data + bech32_create_checksum(hrp, data)
-    return hrp + '1' + ''.join([CHARSET[d] for d in combined])
-
-def convertbits(data, frombits, tobits, pad=True):
-    acc = 0
-    bits = 0
-    ret = []
-    maxv = (1 << tobits) - 1
-    max_acc = (1 << (frombits + tobits - 1)) - 1
-    for value in data:
-        if value < 0 or (value >> frombits):
-            return None
-        acc = ((acc << frombits) | value) & max_acc
-        bits += frombits
-        while bits >= tobits:
-            bits -= tobits
-            ret.append((acc >> bits) & maxv)
-    if pad:
-        if bits:
-            ret.append((acc << (tobits - bits)) & maxv)
-    elif bits >= frombits or ((acc << (tobits - bits)) & maxv):
-        return None
-    return ret
-
-# 生成 BIP84 地址
+# 生成 BIP84 地址（见证版本0，Bech32编码在bech32.py中）
 def generate_bip84_address(public_key):
-    ripemd160 = hash_public_key(public_key)
-    data = convertbits(ripemd160, 8, 5)
-    return bech32_encode("bc", [0] + data)
+    return encode_segwit_address("bc", 0, hash_public_key(public_key))
+
+# ---- ECDSA ----
+# 签名和验证都针对32字节的消息哈希（如SHA-256结果）；签名为(r, s)整数对，s规范化为不超过N/2（low-S）
+G_WNAF_WIDTH = 8  # 验证时G的wNAF窗口，G的奇数倍表只算一次，可以取得比任意点更大
+_g_odd_table = None
+
+def _g_odd_multiples():
+    global _g_odd_table
+    if _g_odd_table is None:
+        table = odd_multiples(G, G_WNAF_WIDTH)
+        _g_odd_table = (table, [(x, P - y) for x, y in table])
+    return _g_odd_table
+
+def rfc6979_nonce(private_key, msg_hash, extra=b''):
+    """RFC 6979 第3.2节的确定性k（HMAC-SHA256），同一私钥和消息总得到同一个k，不依赖随机数质量"""
+    x = private_key.to_bytes(32, 'big')
+    h1 = (int.from_bytes(msg_hash, 'big') % N).to_bytes(32, 'big')
+    v = b'\x01' * 32
+    k = b'\x00' * 32
+    k = hmac.new(k, v + b'\x00' + x + h1 + extra, hashlib.sha256).digest()
+    v = hmac.new(k, v, hashlib.sha256).digest()
+    k = hmac.new(k, v + b'\x01' + x + h1 + extra, hashlib.sha256).digest()
+    v = hmac.new(k, v, hashlib.sha256).digest()
+    while True:
+        v = hmac.new(k, v, hashlib.sha256).digest()
+        candidate = int.from_bytes(v, 'big')
+        if 0 < candidate < N:
+            return candidate
+        k = hmac.new(k, v + b'\x00', hashlib.sha256).digest()
+        v = hmac.new(k, v, hashlib.sha256).digest()
+
+def sign(private_key, msg_hash):
+    """返回(r, s)"""
+    if len(msg_hash) != 32:
+        raise ValueError("消息哈希必须为32字节")
+    z = int.from_bytes(msg_hash, 'big')
+    extra = b''
+    while True:
+        k = rfc6979_nonce(private_key, msg_hash, extra)
+        R = fixed_base_multiply(k)
+        r = R[0] % N
+        s = pow(k, -1, N) * (z + r * private_key) % N
+        if r and s:
+            return (r, min(s, N - s))
+        # 概率可以忽略；按RFC 6979 3.6 加入额外数据重新生成k
+        extra = (int.from_bytes(extra or b'\x00', 'big') + 1).to_bytes(32, 'big')
+
+def _strauss(u1, u2, q_table, q_negated):
+    """Strauss-Shamir：u1*G + u2*Q 共用一条倍点链，返回Jacobian坐标"""
+    g_pos, g_neg = _g_odd_multiples()
+    d1 = wnaf(u1, G_WNAF_WIDTH)
+    d2 = wnaf(u2, WNAF_WIDTH)
+    length = max(len(d1), len(d2))
+    d1 += [0] * (length - len(d1))
+    d2 += [0] * (length - len(d2))
+    acc = None
+    for i in range(length - 1, -1, -1):
+        acc = jacobian_double(acc)
+        a = d1[i]
+        if a > 0:
+            acc = jacobian_add_affine(acc, g_pos[a >> 1])
+        elif a < 0:
+            acc = jacobian_add_affine(acc, g_neg[(-a) >> 1])
+        b = d2[i]
+        if b > 0:
+            acc = jacobian_add_affine(acc, q_table[b >> 1])
+        elif b < 0:
+            acc = jacobian_add_affine(acc, q_negated[(-b) >> 1])
+    return acc
+
+def _x_matches(point, r):
+    """不转换为仿射坐标，直接比较 X == r * Z^2（x坐标模N后等于r，x可能是r或r+N）"""
+    if point is None:
+        return False
+    X, _, Z = point
+    zz = Z * Z % P
+    if X == r * zz % P:
+        return True
+    return r + N < P and X == (r + N) * zz % P
+
+def _valid_public_key(public_key):
+    if public_key is None:
+        return False
+    x, y = public_key
+    return 0 <= x < P and 0 <= y < P and (y * y - x * x * x - B) % P == 0
+
+def verify(public_key, msg_hash, signature):
+    r, s = signature
+    if not (0 < r < N and 0 < s < N) or len(msg_hash) != 32 or not _valid_public_key(public_key):
+        return False
+    w = pow(s, -1, N)
+    z = int.from_bytes(msg_hash, 'big')
+    q_table = odd_multiples(public_key)
+    q_negated = [(x, P - y) for x, y in q_table]
+    return _x_matches(_strauss(z * w % N, r * w % N, q_table, q_negated), r)
+
+def batch_verify(items):
+    """批量验证[(公钥, 消息哈希, (r, s)), ...]，返回同样长度的布尔列表。
+    所有s的模逆合并成一次（Montgomery技巧），所有不同公钥的奇数倍表合并成一次求逆，
+    同一公钥的多条签名共用一张表；最终比较在Jacobian坐标下完成，不再求逆"""
+    results = [False] * len(items)
+    pending = []
+    for index, (public_key, msg_hash, (r, s)) in enumerate(items):
+        if 0 < r < N and 0 < s < N and len(msg_hash) == 32 and _valid_public_key(public_key):
+            pending.append(index)
+    if not pending:
+        return results
+    s_inverses = batch_inverse([items[i][2][1] for i in pending], N)
+    keys = list(dict.fromkeys(items[i][0] for i in pending))
+    per_key = (1 << (WNAF_WIDTH - 2))
+    flat = batch_to_affine([point for key in keys for point in _odd_multiples_jacobian(key)])
+    tables = {}
+    for n, key in enumerate(keys):
+        table = flat[n * per_key:(n + 1) * per_key]
+        tables[key] = (table, [(x, P - y) for x, y in table])
+    for index, w in zip(pending, s_inverses):
+        public_key, msg_hash, (r, _) = items[index]
+        z = int.from_bytes(msg_hash, 'big')
+        q_table, q_negated = tables[public_key]
+        results[index] = _x_matches(_strauss(z * w % N, r * w % N, q_table, q_negated), r)
+    return results
+
+# ---- 批量生成 ----
+BATCH_SIZE = 1000
+OUTPUT_FIELDS = ("private_key", "public_key", "address")
+
+def generate_keypairs(count):
+    """生成count组（私钥, 公钥, 地址）；公钥先在Jacobian坐标下算好，再用一次模逆批量转换为仿射坐标"""
+    keys = [generate_private_key() for _ in range(count)]
+    public_keys = batch_to_affine([fixed_base_multiply_jacobian(k) for k in keys])
+    addresses = encode_segwit_addresses("bc", 0, [hash_public_key(pub) for pub in public_keys])
+    return list(zip(keys, public_keys, addresses))
+
+def _generate_rows(count):
+    """进程池任务：只返回字符串，减少进程间传输的数据量"""
+    return [(f"{k:064x}", compress_public_key(pub).hex(), address)
+            for k, pub, address in generate_keypairs(count)]
+
+def generate_addresses(count, workers=None, batch_size=BATCH_SIZE):
+    """按批分给进程池并按提交顺序逐批产出(私钥hex, 压缩公钥hex, 地址)；
+    在途批次数有上限，生成几百万条时内存占用也不会随count增长"""
+    if workers == 1:
+        for start in range(0, count, batch_size):
+            yield from _generate_rows(min(batch_size, count - start))
+        return
+    max_inflight = 2 * (workers or os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        remaining = count
+        while remaining or pending:
+            while remaining and len(pending) < max_inflight:
+                size = min(batch_size, remaining)
+                pending.append(pool.submit(_generate_rows, size))
+                remaining -= size
+            yield from pending.popleft().result()
+
+def write_rows(rows, out, fmt="csv"):
+    """把生成结果流式写入文本文件对象，返回写出的条数"""
+    written = 0
+    if fmt == "csv":
+        writer = csv.writer(out)
+        writer.writerow(("index",) + OUTPUT_FIELDS)
+        for written, row in enumerate(rows, 1):
+            writer.writerow((written - 1,) + row)
+    else:
+        for written, row in enumerate(rows, 1):
+            record = {"index": written - 1, **dict(zip(OUTPUT_FIELDS, row))}
+            out.write(json.dumps(record) + "\n")
+    return written
+
+def open_private_output(path):
+    """输出包含私钥，新建文件只允许当前用户读写"""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    return open(fd, "w", encoding="utf-8", newline="")
 
 # 主函数
 def main():
@@ -115,5 +459,61 @@ def main():
     print("Public Key:", f"({hex(public_key[0])}, {hex(public_key[1])})")
     print("BIP84 Address:", address)
 
+def benchmark(count=2000):
+    g_table()
+    keys = [generate_private_key() for _ in range(count)]
+    start = time.perf_counter()
+    for k in keys:
+        private_key_to_public_key(k)
+    fixed = count / (time.perf_counter() - start)
+    point = private_key_to_public_key(keys[0])
+    start = time.perf_counter()
+    for k in keys[:count // 10]:
+        scalar_multiplication(k, point)
+    variable = count // 10 / (time.perf_counter() - start)
+    print(f"k*G（定基查表）: {fixed:,.0f} 次/秒")
+    print(f"k*Q（wNAF）: {variable:,.0f} 次/秒")
+    signatures = count // 10
+    items = []
+    start = time.perf_counter()
+    for k in keys[:signatures]:
+        digest = hashlib.sha256(k.to_bytes(32, 'big')).digest()
+        items.append((private_key_to_public_key(keys[0]), digest, sign(keys[0], digest)))
+    signed = signatures / (time.perf_counter() - start)
+    start = time.perf_counter()
+    for public_key, digest, signature in items:
+        verify(public_key, digest, signature)
+    verified = signatures / (time.perf_counter() - start)
+    start = time.perf_counter()
+    batch_verify(items)
+    batched = signatures / (time.perf_counter() - start)
+    print(f"ECDSA签名: {signed:,.0f} 次/秒，逐条验证: {verified:,.0f} 次/秒，批量验证: {batched:,.0f} 次/秒")
+
+def cli():
+    parser = argparse.ArgumentParser(description="secp256k1密钥和BIP84地址生成")
+    sub = parser.add_subparsers(dest="command")
+    p = sub.add_parser("generate", help="批量生成密钥和地址")
+    p.add_argument("-n", "--count", type=int, required=True)
+    p.add_argument("-j", "--workers", type=int, default=None, help="进程数，默认为CPU核数")
+    p.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="每个进程池任务生成的条数")
+    p.add_argument("--format", choices=("csv", "jsonl"), default="csv")
+    p.add_argument("-o", "--output", help="输出文件，默认写到标准输出")
+    sub.add_parser("benchmark", help="测试标量乘法速度")
+    args = parser.parse_args()
+    if args.command == "generate":
+        out = open_private_output(args.output) if args.output else sys.stdout
+        start = time.perf_counter()
+        try:
+            written = write_rows(generate_addresses(args.count, args.workers, args.batch_size), out, args.format)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        elapsed = time.perf_counter() - start
+        print(f"已生成 {written} 条，用时 {elapsed:.1f} 秒（{written / elapsed:,.0f} 条/秒）", file=sys.stderr)
+    elif args.command == "benchmark":
+        benchmark()
+    else:
+        main()
+
 if __name__ == "__main__":
-    main()
+    cli()
@@ -1,22 +1,431 @@
 # Import necessary libraries
-from transformers import BertTokenizer, BertModel
+import os
+import time
+import hashlib
+import sqlite3
+import argparse
+import threading
+from collections import OrderedDict
+from transformers import BertTokenizerFast, BertModel
 import torch
 import numpy as np
 import faiss
 
 # Initialize the BERT tokenizer and model
-tokenizer = BertTokenizer.from_pretrained('bert-base-uncased')
-model = BertModel.from_pretrained('bert-base-uncased')
+MODEL_NAME = 'bert-base-uncased'
+MAX_LENGTH = 128
+BATCH_SIZE = 32
+tokenizer = BertTokenizerFast.from_pretrained(MODEL_NAME)
+model = BertModel.from_pretrained(MODEL_NAME)
+model.eval()
+
+# Encode many sentences at once: tokenize everything in one call, sort by token length so each
+# mini-batch pads to a similar length, and run the forward passes without autograd bookkeeping
+def encode_sentences(sentences, batch_size=BATCH_SIZE):
+    sentences = list(sentences)
+    embeddings = np.zeros((len(sentences), model.config.hidden_size), dtype=np.float32)
+    if not sentences:
+        return embeddings
+    encoded = tokenizer(sentences, truncation=True, max_length=MAX_LENGTH)
+    order = sorted(range(len(sentences)), key=lambda i: len(encoded['input_ids'][i]))
+    with torch.inference_mode():
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            inputs = tokenizer.pad({key: [encoded[key][i] for i in batch] for key in encoded.keys()},
+                                   return_tensors='pt')
+            outputs = model(**inputs)
+            # The [CLS] token's embedding is the sentence representation
+            embeddings[batch] = outputs.last_hidden_state[:, 0, :].float().numpy()
+    return embeddings
 
 # Define a function to encode a sentence using BERT
 def encode_sentence(sentence):
-    # Tokenize the input sentence and convert to tensors
-    inputs = tokenizer(sentence, return_tensors='pt', truncation=True, padding=True, max_length=128)
-    # Pass the inputs through the BERT model
-    outputs = model(**inputs)
-    # Extract the [CLS] token's embedding as the sentence representation
-    cls_embedding = outputs.last_hidden_state[:, 0, :].detach().numpy()
-    return cls_embedding
+    return encode_sentences([sentence])
+
+# Persistent embedding cache: SQLite table keyed by a hash of the model name and the text,
+# so unchanged questions are never encoded again and switching models never returns stale vectors
+EMBEDDING_CACHE_PATH = 'simplechat_embeddings.sqlite'
+
+class EmbeddingCache:
+    def __init__(self, path=EMBEDDING_CACHE_PATH, model_name=MODEL_NAME):
+        self.model_name = model_name
+        self.db = sqlite3.connect(path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vector BLOB NOT NULL)')
+
+    def key(self, text):
+        return hashlib.sha256(f'{self.model_name}\0{text}'.encode('utf-8')).digest()
+
+    def get_many(self, keys):
+        found = {}
+        # Stay under SQLite's limit on the number of bound parameters
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows = self.db.execute(
+                f'SELECT key, vector FROM embeddings WHERE key IN ({",".join("?" * len(chunk))})', chunk)
+            found.update((key, np.frombuffer(vector, dtype=np.float32)) for key, vector in rows)
+        return found
+
+    def put_many(self, items):
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO embeddings VALUES (?, ?)',
+                                ((key, vector.astype(np.float32).tobytes()) for key, vector in items))
+
+    def close(self):
+        self.db.close()
+
+# Encode through the cache: only texts that have never been seen with this model hit BERT
+def encode_with_cache(sentences, cache, batch_size=BATCH_SIZE):
+    sentences = list(sentences)
+    keys = [cache.key(sentence) for sentence in sentences]
+    found = cache.get_many(keys)
+    missing = [i for i, key in enumerate(keys) if key not in found]
+    if missing:
+        fresh = encode_sentences([sentences[i] for i in missing], batch_size)
+        cache.put_many((keys[i], vector) for i, vector in zip(missing, fresh))
+        found.update((keys[i], vector) for i, vector in zip(missing, fresh))
+    embeddings = np.zeros((len(sentences), model.config.hidden_size), dtype=np.float32)
+    for i, key in enumerate(keys):
+        embeddings[i] = found[key]
+    return embeddings
+
+# Side store for the QA texts: the FAISS index only holds vectors and int64 ids,
+# the question/answer for an id is fetched from this table when it is returned as a hit
+QA_STORE_PATH = 'simplechat_qa.sqlite'
+
+class QAStore:
+    def __init__(self, path=QA_STORE_PATH):
+        self.db = sqlite3.connect(path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS qa (id INTEGER PRIMARY KEY, question TEXT UNIQUE NOT NULL, answer TEXT NOT NULL)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+
+    # Random token replaced whenever the set of ids changes, in the same transaction as the change.
+    # Every index file records the generation it was built from, so an index of another type
+    # that missed some changes is detected on load and rebuilt
+    def generation(self):
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+        return row[0] if row else None
+
+    def new_generation(self):
+        generation = os.urandom(16).hex()
+        self.db.execute("INSERT OR REPLACE INTO meta VALUES ('generation', ?)", (generation,))
+        return generation
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM qa').fetchone()[0]
+
+    def get(self, qa_id):
+        return self.db.execute('SELECT question, answer FROM qa WHERE id = ?', (int(qa_id),)).fetchone()
+
+    def find(self, question):
+        row = self.db.execute('SELECT id FROM qa WHERE question = ?', (question,)).fetchone()
+        return row[0] if row else None
+
+    def items(self):
+        return self.db.execute('SELECT id, question, answer FROM qa ORDER BY id').fetchall()
+
+    def close(self):
+        self.db.close()
+
+# Index back ends. All of them search normalized vectors by inner product, so the score is the cosine similarity.
+# flat is exact brute force; ivf/ivfpq only scan the nprobe nearest clusters (ivfpq also compresses vectors
+# to PQ codes), hnsw walks a proximity graph whose search breadth is efSearch
+INDEX_TYPES = ('flat', 'ivf', 'ivfpq', 'hnsw')
+DEFAULT_NPROBE = 16
+DEFAULT_EF_SEARCH = 64
+HNSW_M = 32
+PQ_M = 48
+
+def index_path_for(index_type):
+    return f'simplechat_{index_type}.index'
+
+def index_factory_string(index_type, d, n):
+    # About 4*sqrt(n) clusters, but at least 39 training points per cluster
+    nlist = max(1, min(int(4 * np.sqrt(n)), n // 39))
+    if index_type == 'flat':
+        return 'IDMap,Flat'
+    if index_type == 'ivf':
+        return f'IVF{nlist},Flat'
+    if index_type == 'ivfpq':
+        m = next(m for m in (PQ_M, 32, 16, 8, 4, 2, 1) if d % m == 0)
+        # PQ training needs at least 2**nbits points per sub-quantizer
+        nbits = max(1, min(8, n.bit_length() - 1))
+        return f'IVF{nlist},PQ{m}x{nbits}'
+    if index_type == 'hnsw':
+        return f'IDMap,HNSW{HNSW_M},Flat'
+    raise ValueError(f'unknown index type {index_type!r}, expected one of {INDEX_TYPES}')
+
+def normalized(vectors):
+    vectors = np.array(vectors, dtype=np.float32, order='C')
+    faiss.normalize_L2(vectors)
+    return vectors
+
+# Build (and train, for IVF/PQ) an index of the given type over the embeddings
+def build_index(embeddings, ids, index_type='flat'):
+    vectors = normalized(embeddings)
+    n, d = vectors.shape
+    index = faiss.index_factory(d, index_factory_string(index_type, d, n), faiss.METRIC_INNER_PRODUCT)
+    if index_type == 'ivfpq':
+        # The factory enables polysemous training, which only helps Hamming-filtered search
+        # and makes training two orders of magnitude slower
+        index.do_polysemous_training = False
+    if not index.is_trained:
+        if not n:
+            raise ValueError(f'{index_type} index needs training data')
+        index.train(vectors)
+    if n:
+        index.add_with_ids(vectors, np.asarray(ids, dtype=np.int64))
+    return index
+
+def set_search_params(index, index_type, nprobe=DEFAULT_NPROBE, ef_search=DEFAULT_EF_SEARCH):
+    params = faiss.ParameterSpace()
+    if index_type in ('ivf', 'ivfpq'):
+        params.set_index_parameter(index, 'nprobe', nprobe)
+    elif index_type == 'hnsw':
+        params.set_index_parameter(index, 'efSearch', ef_search)
+
+def save_index(index, path, generation):
+    # Write to a temporary file and rename, so a reader (or a crash) never sees a half-written index
+    # and processes that have the old file memory-mapped keep a valid mapping
+    tmp_path = f'{path}.tmp'
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, path)
+    # The generation goes last: a crash in between leaves a mismatch, which only costs a rebuild
+    with open(tmp_path, 'w') as f:
+        f.write(generation or '')
+    os.replace(tmp_path, f'{path}.generation')
+
+def index_generation(path):
+    try:
+        with open(f'{path}.generation') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+def load_index(path):
+    # Memory-map the vectors instead of reading them into RAM: startup cost no longer grows with the corpus
+    return faiss.read_index(path, faiss.IO_FLAG_MMAP)
+
+# Bounded LRU cache whose entries also expire after ttl seconds
+QUERY_CACHE_SIZE = 10000
+QUERY_CACHE_TTL = 3600
+
+class QueryCache:
+    def __init__(self, max_entries=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL):
+        self._entries = OrderedDict()  # key -> (expiry, value), least recently used first
+        self._lock = threading.Lock()
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= now:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+# The model is uncased, so case and runs of whitespace do not change the embedding;
+# folding them lets trivially different spellings of a query share cache entries
+def normalize_query(query):
+    return ' '.join(query.lower().split())
+
+# Query text -> embedding, shared by every knowledge base since it depends only on the model
+query_embeddings = QueryCache()
+
+# The FAISS index plus the QA store behind it. Index ids are rows of the store; every change is written
+# to the index file before the store transaction commits
+class KnowledgeBase:
+    def __init__(self, index_type='flat', store_path=QA_STORE_PATH, index_path=None, cache=None,
+                 nprobe=DEFAULT_NPROBE, ef_search=DEFAULT_EF_SEARCH):
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f'unknown index type {index_type!r}, expected one of {INDEX_TYPES}')
+        self.index_type = index_type
+        self.index_path = index_path or index_path_for(index_type)
+        self.store = QAStore(store_path)
+        self.cache = cache or EmbeddingCache()
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.index = None
+        self.mapped = False
+        # (normalized query, k) -> results; dropped whenever the corpus changes
+        self.results = QueryCache()
+        self._load_texts()
+        if self.store.generation() is None:
+            # Store created before generations were recorded: start one, so indexes saved from now on can be checked
+            with self.store.db:
+                self.store.new_generation()
+        # Cold start: load the saved index; only a missing or stale index is rebuilt from the store
+        if os.path.exists(self.index_path) and index_generation(self.index_path) == self.store.generation():
+            index = load_index(self.index_path)
+            if index.ntotal == len(self.store):
+                self._use(index, mapped=True)
+        if self.index is None and len(self.store):
+            self.rebuild()
+
+    def _load_texts(self):
+        # Lists indexed by id, so turning search hits into texts is a list lookup rather than a query
+        rows = self.store.items()
+        self.questions = []
+        self.answers = []
+        self._set_texts(rows)
+
+    def _set_texts(self, rows):
+        for qa_id, question, answer in rows:
+            if qa_id >= len(self.questions):
+                grow = qa_id + 1 - len(self.questions)
+                self.questions.extend([None] * grow)
+                self.answers.extend([None] * grow)
+            self.questions[qa_id] = question
+            self.answers[qa_id] = answer
+
+    def lookup(self, qa_id):
+        if 0 <= qa_id < len(self.questions) and self.questions[qa_id] is not None:
+            return self.questions[qa_id], self.answers[qa_id]
+        return None
+
+    def _use(self, index, mapped=False):
+        set_search_params(index, self.index_type, self.nprobe, self.ef_search)
+        self.index = index
+        self.mapped = mapped
+
+    def _writable(self):
+        # Memory-mapped IVF lists are read-only, so load a private copy before changing the index
+        if self.mapped:
+            self._use(faiss.read_index(self.index_path))
+
+    def rebuild(self):
+        # Re-encodes nothing that is already in the embedding cache; IVF/PQ are retrained on the whole corpus
+        rows = self.store.items()
+        embeddings = encode_with_cache([row[1] for row in rows], self.cache)
+        self._use(build_index(embeddings, [row[0] for row in rows], self.index_type))
+        save_index(self.index, self.index_path, self.store.generation())
+        self.results.clear()
+
+    # Add QA pairs (existing questions get their answer updated)
+    def add(self, pairs):
+        store = self.store
+        new_ids, new_questions, changed = [], [], []
+        try:
+            for question, answer in pairs:
+                qa_id = store.find(question)
+                if qa_id is None:
+                    qa_id = store.db.execute('INSERT INTO qa (question, answer) VALUES (?, ?)', (question, answer)).lastrowid
+                    new_ids.append(qa_id)
+                    new_questions.append(question)
+                else:
+                    store.db.execute('UPDATE qa SET answer = ? WHERE id = ?', (answer, qa_id))
+                changed.append((qa_id, question, answer))
+            if new_ids:
+                store.new_generation()
+                if self.index is None:
+                    # First entries: train the index on them
+                    self.rebuild()
+                else:
+                    self._writable()
+                    vectors = normalized(encode_with_cache(new_questions, self.cache))
+                    self.index.add_with_ids(vectors, np.array(new_ids, dtype=np.int64))
+                    save_index(self.index, self.index_path, self.store.generation())
+            store.db.commit()
+        except BaseException:
+            store.db.rollback()
+            if new_ids and self.index is not None:
+                self.index.remove_ids(np.array(new_ids, dtype=np.int64))
+            raise
+        self._set_texts(changed)
+        self.results.clear()
+        return new_ids
+
+    # Remove QA pairs by id from both the index and the store
+    def delete(self, ids):
+        ids = [int(qa_id) for qa_id in ids]
+        with self.store.db:
+            removed = self.store.db.executemany('DELETE FROM qa WHERE id = ?', ((qa_id,) for qa_id in ids)).rowcount
+            self.store.new_generation()
+            if self.index_type == 'hnsw':
+                # HNSW graphs do not support removal: rebuild from the store (embeddings come from the cache)
+                self.rebuild()
+            elif self.index is not None:
+                self._writable()
+                self.index.remove_ids(np.array(ids, dtype=np.int64))
+                save_index(self.index, self.index_path, self.store.generation())
+        for qa_id in ids:
+            if 0 <= qa_id < len(self.questions):
+                self.questions[qa_id] = self.answers[qa_id] = None
+        self.results.clear()
+        return removed
+
+    def search(self, embeddings, k):
+        if self.index is None:
+            n = len(embeddings)
+            return np.full((n, k), -1, dtype=np.float32), np.full((n, k), -1, dtype=np.int64)
+        return self.index.search(normalized(embeddings), k)
+
+    def close(self):
+        self.store.close()
+        self.cache.close()
+
+# Open the knowledge base; the seed pairs are only added when the store is empty
+def open_knowledge_base(seed_pairs, index_type='flat', **kwargs):
+    knowledge_base = KnowledgeBase(index_type, **kwargs)
+    if not len(knowledge_base.store):
+        knowledge_base.add(seed_pairs.items())
+    return knowledge_base
+
+# Recall-vs-latency benchmark of the ANN back ends against exact search, on clustered synthetic vectors
+def benchmark_indexes(size=100000, dim=768, queries=1000, k=10, index_types=('ivf', 'ivfpq', 'hnsw'),
+                      nprobes=(1, 4, 16, 64), ef_searches=(16, 64, 256), seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(1, size // 100), dim), dtype=np.float32)
+    data = normalized(centers[rng.integers(0, len(centers), size)] + 0.5 * rng.standard_normal((size, dim), dtype=np.float32))
+    xq = normalized(centers[rng.integers(0, len(centers), queries)] + 0.5 * rng.standard_normal((queries, dim), dtype=np.float32))
+    ids = np.arange(size, dtype=np.int64)
+
+    def measure(index):
+        latencies = np.empty(queries)
+        found = np.empty((queries, k), dtype=np.int64)
+        for i in range(queries):
+            begin = time.perf_counter()
+            found[i] = index.search(xq[i:i + 1], k)[1][0]
+            latencies[i] = time.perf_counter() - begin
+        return found, latencies
+
+    print(f"{size} vectors, dim {dim}, {queries} single-vector queries, recall@{k} against flat")
+    print(f"{'index':<8}{'param':>14}{'build s':>10}{'recall':>9}{'p50 ms':>9}{'p99 ms':>9}")
+    begin = time.perf_counter()
+    flat = build_index(data, ids, 'flat')
+    build_time = time.perf_counter() - begin
+    truth, latencies = measure(flat)
+    print(f"{'flat':<8}{'-':>14}{build_time:>10.2f}{1.0:>9.3f}{np.percentile(latencies, 50) * 1e3:>9.3f}"
+          f"{np.percentile(latencies, 99) * 1e3:>9.3f}")
+    for index_type in index_types:
+        begin = time.perf_counter()
+        index = build_index(data, ids, index_type)
+        build_time = time.perf_counter() - begin
+        name, values = ('efSearch', ef_searches) if index_type == 'hnsw' else ('nprobe', nprobes)
+        for value in values:
+            set_search_params(index, index_type, nprobe=value, ef_search=value)
+            found, latencies = measure(index)
+            recall = np.mean([len(np.intersect1d(a, b)) / k for a, b in zip(found, truth)])
+            print(f"{index_type:<8}{f'{name}={value}':>14}{build_time:>10.2f}{recall:>9.3f}"
+                  f"{np.percentile(latencies, 50) * 1e3:>9.3f}{np.percentile(latencies, 99) * 1e3:>9.3f}")
 
 # Sample dictionary of medical and coding questions and answers
 qa_pairs = {
@@ -45,36 +454,113 @@ qa_pairs = {
     "How do you write a function in Python?": "Define a function using the `def` keyword, followed by the function name and parentheses. For example, `def my_function():` followed by the function body."
 }
 
-# Encode all questions in the dictionary
-question_embeddings = np.array([encode_sentence(q) for q in qa_pairs.keys()]).squeeze()
-
-# Initialize a FAISS index for similarity search
-d = question_embeddings.shape[1]  # Dimension of the embeddings
-index = faiss.IndexFlatL2(d)      # Use L2 distance for the index
-index.add(question_embeddings)    # Add the question embeddings to the index
+# Persisted FAISS index and QA store (the dictionary above only seeds an empty store); opened by main()
+# or, with the default flat index, on the first query
+knowledge_base = None
 
 # Function to find the top k most similar questions and provide their answers
 def find_top_k_similar_questions(query, k=1):
-    # Encode the query using BERT
-    query_embedding = encode_sentence(query).squeeze()
-    # Search the FAISS index for the top k nearest neighbors
-    D, I = index.search(query_embedding.reshape(1, -1), k)
+    return find_top_k_similar_questions_batch([query], k)[0]
+
+# Answer many queries at once: cached results are returned as is, the remaining queries are encoded
+# in one BERT batch and searched with a single index.search call
+def find_top_k_similar_questions_batch(queries, k=1):
+    global knowledge_base
+    if knowledge_base is None:
+        knowledge_base = open_knowledge_base(qa_pairs)
+    keys = [normalize_query(query) for query in queries]
+    answers = [None] * len(keys)
+    pending = {}  # normalized query -> positions in the batch waiting for it
+    for i, key in enumerate(keys):
+        # Repeated queries are answered from the result cache without touching the model or the index
+        results = knowledge_base.results.get((key, k))
+        if results is not None:
+            answers[i] = list(results)
+        else:
+            pending.setdefault(key, []).append(i)
+    if not pending:
+        return answers
+    # Encode the queries using BERT (reusing the embeddings of earlier identical queries)
+    texts = list(pending)
+    embeddings = [query_embeddings.get(text) for text in texts]
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    if missing:
+        for i, embedding in zip(missing, encode_sentences([texts[i] for i in missing])):
+            embeddings[i] = embedding
+            query_embeddings.put(texts[i], embedding)
+    # Search the FAISS index for the top k nearest neighbors of every query
+    D, I = knowledge_base.search(np.vstack(embeddings), k)
     # Retrieve the top k most similar questions and their corresponding answers
-    results = []
-    for i in range(k):
-        similar_question = list(qa_pairs.keys())[I[0][i]]
-        similarity_score = 1 / (1 + D[0][i])  # Convert L2 distance to a similarity score
-        results.append((similar_question, qa_pairs[similar_question], similarity_score))
-    return results
-
-# Test the question-answering system with a query
-query = "How can I manage high blood pressure?"
-top_k_results = find_top_k_similar_questions(query, k=2)
-
-# Print the results
-print(f"Query: {query}")
-for idx, (matched_question, answer, score) in enumerate(top_k_results, start=1):
-    print(f"\nTop {idx} Match:")
-    print(f"Matched Question: {matched_question}")
-    print(f"Answer: {answer}")
-    print(f"Similarity Score: {score:.4f}")
+    for text, scores, ids in zip(texts, D, I):
+        results = []
+        for similarity_score, qa_id in zip(scores, ids):
+            row = knowledge_base.lookup(qa_id)  # None for the -1 padding when fewer than k entries exist
+            if row is None:
+                continue
+            similar_question, answer = row
+            # Inner product of normalized vectors = cosine similarity
+            results.append((similar_question, answer, float(similarity_score)))
+        knowledge_base.results.put((text, k), tuple(results))
+        for i in pending[text]:
+            answers[i] = list(results)
+    return answers
+
+def main():
+    global knowledge_base
+    parser = argparse.ArgumentParser(description="BERT + FAISS question answering")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default="flat")
+    parser.add_argument("--nprobe", type=int, default=DEFAULT_NPROBE, help="clusters scanned per query (ivf, ivfpq)")
+    parser.add_argument("--ef-search", type=int, default=DEFAULT_EF_SEARCH, help="graph search breadth (hnsw)")
+    subparsers = parser.add_subparsers(dest="command")
+    query_parser = subparsers.add_parser("query", help="find the most similar questions")
+    query_parser.add_argument("query", nargs="?", default="How can I manage high blood pressure?")
+    query_parser.add_argument("-k", type=int, default=2)
+    add_parser = subparsers.add_parser("add", help="add or update a QA pair")
+    add_parser.add_argument("question")
+    add_parser.add_argument("answer")
+    delete_parser = subparsers.add_parser("delete", help="delete QA pairs by id")
+    delete_parser.add_argument("ids", type=int, nargs="+")
+    subparsers.add_parser("list", help="list all QA pairs")
+    subparsers.add_parser("rebuild", help="rebuild (and retrain) the index from the QA store")
+    bench_parser = subparsers.add_parser("benchmark", help="recall vs latency of the ANN indexes on synthetic data")
+    bench_parser.add_argument("--size", type=int, default=100000)
+    bench_parser.add_argument("--dim", type=int, default=768)
+    bench_parser.add_argument("--queries", type=int, default=1000)
+    bench_parser.add_argument("-k", type=int, default=10)
+    bench_parser.add_argument("--types", default="ivf,ivfpq,hnsw")
+    args = parser.parse_args()
+
+    if args.command == "benchmark":
+        benchmark_indexes(args.size, args.dim, args.queries, args.k, args.types.split(","))
+        return
+    knowledge_base = open_knowledge_base(qa_pairs, args.index_type, nprobe=args.nprobe, ef_search=args.ef_search)
+    if args.command == "add":
+        ids = knowledge_base.add([(args.question, args.answer)])
+        print(f"Added id {ids[0]}" if ids else "Updated existing question")
+        return
+    if args.command == "delete":
+        print(f"Removed {knowledge_base.delete(args.ids)} entries")
+        return
+    if args.command == "list":
+        for qa_id, question, _ in knowledge_base.store.items():
+            print(f"{qa_id}\t{question}")
+        return
+    if args.command == "rebuild":
+        knowledge_base.rebuild()
+        print(f"Rebuilt {args.index_type} index with {knowledge_base.index.ntotal} entries")
+        return
+
+    # Test the question-answering system with a query
+    query = getattr(args, "query", "How can I manage high blood pressure?")
+    top_k_results = find_top_k_similar_questions(query, k=getattr(args, "k", 2))
+
+    # Print the results
+    print(f"Query: {query}")
+    for idx, (matched_question, answer, score) in enumerate(top_k_results, start=1):
+        print(f"\nTop {idx} Match:")
+        print(f"Matched Question: {matched_question}")
+        print(f"Answer: {answer}")
+        print(f"Similarity Score: {score:.4f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# Query server for simplechat: one JSON object per line in, one JSON object per line out.
+# Concurrent queries are collected for a few milliseconds and answered together, so N clients
+# cost one BERT forward pass and one index.search instead of N of each.
+import json
+import time
+import asyncio
+import argparse
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from x25519_metrics import METRICS, serve_metrics
+# simplechat loads BERT on import, so it is only imported by serve(); the load test client does not need it
+
+SERVER_HOST = '127.0.0.1'
+SERVER_PORT = 8765
+BATCH_WINDOW = 0.003   # How long the first query of a batch waits for others (seconds)
+MAX_BATCH = 64         # A full batch is flushed without waiting for the window
+MAX_K = 100
+MAX_LINE = 64 * 1024
+PIPELINE_DEPTH = 128   # Queries a connection may have in flight before we stop reading from it
+METRICS_PORT = 0       # 127.0.0.1 only, 0 disables the endpoint
+LOAD_TEST_QUESTIONS = (
+    "What are the symptoms of COVID-19?",
+    "How is hypertension diagnosed?",
+    "How can I prevent heart disease?",
+    "How is asthma treated?",
+    "What is the treatment for insomnia?",
+    "How can I manage stress effectively?",
+    "How do you read a CSV file in Python?",
+    "How do you handle exceptions in Python?",
+)
+
+class MicroBatcher:
+    """Collects queries from all connections and answers them in batches on one worker thread;
+    answer(batch) is called there with a list of (query, k, future) and returns one result list per entry"""
+    def __init__(self, answer, window=BATCH_WINDOW, max_batch=MAX_BATCH):
+        self.answer = answer
+        self.window = window
+        self.max_batch = max_batch
+        self._pending = []   # (query, k, future)
+        self._timer = None
+        self._running = set()  # The event loop only keeps weak references to tasks
+        # A single worker keeps batches in order and leaves the event loop free while BERT runs;
+        # queries that arrive during a batch simply form the next one
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='simplechat-batch')
+
+    def submit(self, query, k):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((query, k, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._flush)
+        return future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch):
+        # batched_queries / batches is the mean batch size
+        METRICS.incr('batches')
+        METRICS.incr('batched_queries', len(batch))
+        loop = asyncio.get_running_loop()
+        try:
+            with METRICS.timer('batch'):
+                answers = await loop.run_in_executor(self._executor, self.answer, batch)
+        except Exception as exc:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        for (_, _, future), results in zip(batch, answers):
+            if not future.done():
+                future.set_result(results)
+
+def answer_batch(find_batch, batch):
+    # One search per distinct k (normally just one); results of a larger k are not reused for a
+    # smaller one because the result cache is keyed by (query, k)
+    by_k = {}
+    for i, (query, k, _) in enumerate(batch):
+        by_k.setdefault(k, []).append(i)
+    answers = [None] * len(batch)
+    for k, positions in by_k.items():
+        results = find_batch([batch[i][0] for i in positions], k)
+        for i, result in zip(positions, results):
+            answers[i] = result
+    return answers
+
+def parse_request(line):
+    request = json.loads(line)
+    query = request['query']
+    k = int(request.get('k', 1))
+    if not isinstance(query, str) or not 1 <= k <= MAX_K:
+        raise ValueError('query must be a string and k between 1 and %d' % MAX_K)
+    return query, k
+
+async def handle_connection(reader, writer, batcher):
+    METRICS.incr('connections')
+    # Responses are written in request order, so a client may pipeline several queries
+    responses = asyncio.Queue(PIPELINE_DEPTH)
+
+    async def send_loop():
+        while True:
+            item = await responses.get()
+            if item is None:
+                break
+            started, future = item
+            try:
+                results = await future
+                body = {'results': [{'question': q, 'answer': a, 'score': round(score, 6)} for q, a, score in results]}
+            except Exception as exc:
+                METRICS.incr('errors')
+                body = {'error': str(exc)}
+            writer.write(json.dumps(body, ensure_ascii=False).encode('utf-8') + b'\n')
+            METRICS.observe('query', time.perf_counter_ns() - started)
+            if responses.empty():
+                await writer.drain()
+
+    async def enqueue(item):
+        # Returns False once the sender has stopped (e.g. drain() failed): nothing consumes the queue
+        # any more, so put() on a full queue would block forever
+        if sender.done():
+            return False
+        if not responses.full():
+            responses.put_nowait(item)
+            return True
+        put = asyncio.ensure_future(responses.put(item))
+        try:
+            await asyncio.wait((put, sender), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            put.cancel()
+        return not sender.done()
+
+    sender = asyncio.create_task(send_loop())
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            started = time.perf_counter_ns()
+            try:
+                query, k = parse_request(line)
+            except (ValueError, KeyError, TypeError) as exc:
+                future = asyncio.get_running_loop().create_future()
+                future.set_exception(ValueError(f'bad request: {exc}'))
+            else:
+                METRICS.incr('queries')
+                future = batcher.submit(query, k)
+            if not await enqueue((started, future)):
+                break
+    except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+        pass
+    finally:
+        try:
+            await enqueue(None)
+            await sender
+        except Exception:
+            # The peer went away or a write failed; nothing more can be sent either way
+            pass
+        finally:
+            sender.cancel()
+            writer.close()
+
+async def serve(host=SERVER_HOST, port=SERVER_PORT, unix_path=None, window=BATCH_WINDOW, max_batch=MAX_BATCH,
+                metrics_port=METRICS_PORT, index_type='flat', **index_options):
+    import simplechat
+    simplechat.knowledge_base = simplechat.open_knowledge_base(simplechat.qa_pairs, index_type, **index_options)
+    batcher = MicroBatcher(functools.partial(answer_batch, simplechat.find_top_k_similar_questions_batch),
+                           window, max_batch)
+    handler = lambda reader, writer: handle_connection(reader, writer, batcher)
+    if unix_path:
+        server = await asyncio.start_unix_server(handler, unix_path, limit=MAX_LINE)
+    else:
+        server = await asyncio.start_server(handler, host, port, limit=MAX_LINE)
+    if metrics_port:
+        serve_metrics(METRICS, port=metrics_port)
+    print(f"Serving {simplechat.knowledge_base.index_type} index of {len(simplechat.knowledge_base.store)} QA pairs on "
+          f"{unix_path or f'{host}:{port}'} (window {window * 1000:g} ms, batch {max_batch})")
+    async with server:
+        await server.serve_forever()
+
+# -------------------- Load test --------------------
+async def _client(host, port, unix_path, queries, k, latencies):
+    if unix_path:
+        reader, writer = await asyncio.open_unix_connection(unix_path, limit=MAX_LINE)
+    else:
+        reader, writer = await asyncio.open_connection(host, port, limit=MAX_LINE)
+    for query in queries:
+        started = time.perf_counter()
+        writer.write(json.dumps({'query': query, 'k': k}).encode('utf-8') + b'\n')
+        response = json.loads(await reader.readline())
+        latencies.append(time.perf_counter() - started)
+        if 'error' in response:
+            raise RuntimeError(response['error'])
+    writer.close()
+
+async def load_test(clients=32, requests=20, k=2, host=SERVER_HOST, port=SERVER_PORT, unix_path=None, distinct=True):
+    """Every client sends its queries one at a time; with distinct=True no two queries are equal,
+    so the result cache never answers and every query goes through BERT"""
+    questions = LOAD_TEST_QUESTIONS
+    latencies = []
+    tasks = []
+    for c in range(clients):
+        queries = [f"{questions[(c + i) % len(questions)]} (client {c} request {i})" if distinct
+                   else questions[(c + i) % len(questions)] for i in range(requests)]
+        tasks.append(_client(host, port, unix_path, queries, k, latencies))
+    started = time.perf_counter()
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    total = clients * requests
+    print(f"{total} queries from {clients} clients in {elapsed:.2f}s: {total / elapsed:.0f} queries/s, "
+          f"p50 {latencies[total // 2] * 1000:.1f} ms, p99 {latencies[min(total - 1, total * 99 // 100)] * 1000:.1f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-batching query server for simplechat")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    p = subparsers.add_parser("serve", help="run the query server")
+    p.add_argument("--host", default=SERVER_HOST)
+    p.add_argument("--port", type=int, default=SERVER_PORT)
+    p.add_argument("--unix", help="listen on this Unix socket path instead of TCP")
+    p.add_argument("--window", type=float, default=BATCH_WINDOW * 1000, help="batching window in milliseconds")
+    p.add_argument("--max-batch", type=int, default=MAX_BATCH)
+    p.add_argument("--index-type", default="flat", help="flat, ivf, ivfpq or hnsw")
+    p.add_argument("--nprobe", type=int, help="clusters scanned per query (ivf, ivfpq)")
+    p.add_argument("--ef-search", type=int, help="graph search breadth (hnsw)")
+    p.add_argument("--metrics-port", type=int, default=METRICS_PORT, help="local metrics endpoint port, 0 disables it")
+    p = subparsers.add_parser("loadtest", help="concurrent clients against a running server")
+    p.add_argument("-n", "--clients", type=int, default=32)
+    p.add_argument("-m", "--requests", type=int, default=20, help="queries per client")
+    p.add_argument("-k", type=int, default=2)
+    p.add_argument("--host", default=SERVER_HOST)
+    p.add_argument("--port", type=int, default=SERVER_PORT)
+    p.add_argument("--unix")
+    p.add_argument("--repeat", action="store_true", help="send the same questions verbatim, so the result cache answers")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        # Unset tuning options fall back to simplechat's defaults
+        index_options = {name: value for name, value in (("nprobe", args.nprobe), ("ef_search", args.ef_search))
+                         if value is not None}
+        try:
+            asyncio.run(serve(args.host, args.port, args.unix, args.window / 1000, args.max_batch, args.metrics_port,
+                              args.index_type, **index_options))
+        except KeyboardInterrupt:
+            pass
+    else:
+        asyncio.run(load_test(args.clients, args.requests, args.k, args.host, args.port, args.unix, not args.repeat))
+
+if __name__ == "__main__":
+    main()
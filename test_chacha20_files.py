@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+import os
+import io
+import shutil
+import tempfile
+import unittest
+import contextlib
+import chacha20_files
+from chacha20_files import HEADER, MAGIC, SUFFIX, PARTIAL_SUFFIX
+
+class MalformedHeaderTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.good = os.path.join(self.dir, "good.txt")
+        with open(self.good, 'wb') as f:
+            f.write(b"hello" * 1000)
+        with contextlib.redirect_stdout(io.StringIO()):
+            chacha20_files.encrypt_files(self.good, "pw", chunk_size=1024, workers=1)
+
+    def _forge(self, name, chunk_size, size, body=b''):
+        path = os.path.join(self.dir, name + SUFFIX)
+        with open(path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, b'\0' * 16, b'\0' * 8, chunk_size, size) + body)
+        return path
+
+    def _decrypt_dir(self):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            chacha20_files.decrypt_files(self.dir, "pw", workers=1)
+        return out.getvalue()
+
+    def test_zero_chunk_size(self):
+        path = self._forge("zero.bin", 0, 100, b'\0' * 116)
+        with open(path, 'rb') as f, self.assertRaises(ValueError):
+            chacha20_files.read_header(f)
+        output = self._decrypt_dir()
+        self.assertIn("跳过: " + path, output)
+        # 其余文件照常解密，且不留下临时文件
+        with open(self.good, 'rb') as f:
+            self.assertEqual(f.read(), b"hello" * 1000)
+        self.assertTrue(os.path.exists(path))
+        self.assertFalse([n for n in os.listdir(self.dir) if n.endswith(PARTIAL_SUFFIX)])
+
+    def test_size_does_not_match_container(self):
+        # 声称明文长达1 TiB的短文件不能导致预分配巨大的输出文件
+        path = self._forge("huge.bin", 1024, 1 << 40, b'\0' * 100)
+        with self.assertRaises(ValueError):
+            chacha20_files.decrypt_chunk(path, "pw", 0)
+        output = self._decrypt_dir()
+        self.assertIn("跳过: " + path, output)
+        self.assertFalse(os.path.exists(os.path.join(self.dir, "huge.bin")))
+        self.assertFalse([n for n in os.listdir(self.dir) if n.endswith(PARTIAL_SUFFIX)])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+import os
+import atexit
+import logging
+import tempfile
+import unittest
+from x25519_metrics import configure_logging
+
+class ConfigureLoggingTest(unittest.TestCase):
+    def setUp(self):
+        self.root = logging.getLogger()
+        self.saved = (list(self.root.handlers), self.root.level)
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        for handler in list(self.root.handlers):
+            self.root.removeHandler(handler)
+        for handler in self.saved[0]:
+            self.root.addHandler(handler)
+        self.root.setLevel(self.saved[1])
+        self.tmp.cleanup()
+
+    def test_replaces_existing_root_handlers(self):
+        # 模拟同一进程里客户端部分先做过basicConfig
+        earlier = logging.FileHandler(os.path.join(self.tmp.name, "client.log"), encoding="utf-8")
+        self.root.addHandler(earlier)
+        listener = configure_logging(os.path.join(self.tmp.name, "server.log"), console=False)
+        try:
+            self.assertEqual(len(self.root.handlers), 1)
+            self.assertIsInstance(self.root.handlers[0], logging.handlers.QueueHandler)
+            self.assertIsNone(earlier.stream)   # 已关闭
+            logging.getLogger("test").warning("hello")
+        finally:
+            atexit.unregister(listener.stop)
+            listener.stop()
+            for handler in listener.handlers:
+                handler.close()
+        with open(os.path.join(self.tmp.name, "client.log"), encoding="utf-8") as f:
+            self.assertEqual(f.read(), "")
+        with open(os.path.join(self.tmp.name, "server.log"), encoding="utf-8") as f:
+            self.assertEqual(f.read().count("hello"), 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+import os
+import time
+import asyncio
+import logging
+import argparse
+from cryptography.hazmat.primitives.asymmetric import x25519
+from cryptography.hazmat.primitives import serialization
+from x25519_session import (
+    SessionCipher, AsyncFrameWriter, KeyDerivationPool, TicketStore, ResumptionTicket, read_frame_async,
+    resumption_secret, resumed_session_key, resume_hello,
+    MSG_DATA, MSG_RESEND, MSG_READY, MSG_TICKET, MSG_RESUME_REJECTED, KDF_SCRYPT, KDF_RESUME, PROTOCOL_VERSIONS,
+    FRAME_HEADER,
+)
+import x25519_metrics
+from x25519_metrics import METRICS
+
+# -------------------- 配置日志 --------------------
+def configure_logging():
+    """只在启动服务器时配置，压力测试客户端不写server.log；写文件在后台线程，相同日志限流"""
+    x25519_metrics.configure_logging("server.log", logging.INFO)
+
+# -------------------- 服务器配置 --------------------
+SERVER_HOST = ''
+SERVER_PORT = 65432
+HANDSHAKE_TIMEOUT = 10  # 等待客户端公钥的超时（秒），不含密钥派生的排队时间
+SEND_QUEUE_SIZE = 256   # 每个连接待发送消息的上限，满了之后转发方等待，形成背压
+LISTEN_BACKLOG = 4096
+SEND_BATCH = 256        # 一次写出的最多消息数
+COALESCE_DELAY = 0      # 队列中只有一条消息时等待更多消息的时间（秒），0表示不等待
+METRICS_PORT = 9465     # 只监听127.0.0.1，0表示不开启
+SLOW_CLIENT_TIMEOUT = 5 # 对端队列满时最多等待的时间（秒），超时视为慢客户端并断开
+
+def raw_public_bytes(private_key):
+    return private_key.public_key().public_bytes(
+        encoding=serialization.Encoding.Raw,
+        format=serialization.PublicFormat.Raw
+    )
+
+# -------------------- 单个连接 --------------------
+class ClientConnection:
+    """一个已完成握手的客户端：会话密钥、写端和待发送队列"""
+    def __init__(self, session, writer, addr):
+        self.session = session
+        self.addr = addr
+        self.writer = writer
+        self.frames = AsyncFrameWriter(writer, METRICS)
+        self.queue = asyncio.Queue(SEND_QUEUE_SIZE)
+        self.closed = False
+        self._closed_event = asyncio.Event()
+
+    def close(self, abort=False):
+        """标记连接已关闭并唤醒所有等待向其队列写入的转发方"""
+        if self.closed:
+            return
+        self.closed = True
+        self._closed_event.set()
+        if abort:
+            # 慢客户端不读数据，普通close会一直等待缓冲区写完
+            self.writer.transport.abort()
+        else:
+            self.writer.close()
+
+    def try_enqueue(self, item):
+        """队列未满时直接放入并返回True；连接已关闭时丢弃消息，同样返回True"""
+        if self.closed:
+            return True
+        if self.queue.full():
+            return False
+        self.queue.put_nowait(item)
+        return True
+
+    async def enqueue(self, item, timeout=SLOW_CLIENT_TIMEOUT):
+        """队列满时等待，直到有空位、连接关闭或超时；超时的对端被断开，不能无限期拖住转发方"""
+        if self.try_enqueue(item):
+            return
+        put = asyncio.ensure_future(self.queue.put(item))
+        closed = asyncio.ensure_future(self._closed_event.wait())
+        try:
+            done, _ = await asyncio.wait({put, closed}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            put.cancel()
+            closed.cancel()
+        if put not in done and not self.closed:
+            METRICS.incr("slow_client_disconnects")
+            logging.warning("客户端 %s 的发送队列 %g 秒未腾出空位，断开连接", self.addr, timeout)
+            self.close(abort=True)
+
+    async def send_loop(self):
+        """唯一的写协程，保证同一连接上的帧按顺序加密和发送；
+        队列里已积压的消息（最多SEND_BATCH条）批量加密后一次写出"""
+        while True:
+            item = await self.queue.get()
+            if COALESCE_DELAY and self.queue.empty():
+                # 给其他转发方一点时间把消息放进来，用少量延迟换更少的写调用
+                await asyncio.sleep(COALESCE_DELAY)
+            batch = []
+            while True:
+                if isinstance(item, tuple):
+                    if batch:
+                        self.frames.send_sealed_batch(self.session, batch)
+                        batch = []
+                    self.frames.send(*item)
+                else:
+                    batch.append(item)
+                if len(batch) >= SEND_BATCH or self.queue.empty():
+                    break
+                item = self.queue.get_nowait()
+            if batch:
+                self.frames.send_sealed_batch(self.session, batch)
+            await self.frames.drain()
+
+# -------------------- 服务器 --------------------
+class ChatServer:
+    """在一个事件循环上处理所有连接，把每个客户端的消息转发给其他客户端"""
+    def __init__(self, kdf_pool, tickets, versions=PROTOCOL_VERSIONS):
+        self.clients = set()
+        self.kdf_pool = kdf_pool
+        self.tickets = tickets
+        self.versions = versions
+
+    async def handle_connection(self, reader, writer):
+        addr = writer.get_extra_info('peername')
+        start = time.perf_counter_ns()
+        try:
+            aes_key = await self.handshake(reader, writer)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError) as e:
+            METRICS.incr("handshake_failures")
+            logging.warning("握手失败，连接来自：%s，原因：%r", addr, e)
+            writer.close()
+            return
+        METRICS.observe("handshake", time.perf_counter_ns() - start)
+        client = ClientConnection(SessionCipher(aes_key, is_server=True), writer, addr)
+        self.clients.add(client)
+        # 发送循环启动前直接写出，保证票据和就绪通知是该连接的前两帧
+        client.frames.send_sealed(client.session, self.tickets.issue(aes_key), MSG_TICKET)
+        client.frames.send(MSG_READY)
+        sender = asyncio.create_task(client.send_loop())
+        logging.info("建立新会话，连接来自：%s，当前在线 %d", addr, len(self.clients))
+        try:
+            await self.receive_loop(client, reader)
+        except (ConnectionError, ValueError) as e:
+            logging.warning("【接收】连接 %s 异常：%r", addr, e)
+        finally:
+            self.clients.discard(client)
+            sender.cancel()
+            # 唤醒正阻塞在该连接队列上的转发方，否则它们永远等不到空位
+            client.close()
+            logging.info("会话结束：%s，当前在线 %d", addr, len(self.clients))
+
+    async def handshake(self, reader, writer):
+        """完成握手并返回会话密钥"""
+        private_key = x25519.X25519PrivateKey.generate()
+        salt = os.urandom(16)
+        writer.write(raw_public_bytes(private_key) + salt)
+        await writer.drain()
+        client_hello = await asyncio.wait_for(reader.readexactly(33), HANDSHAKE_TIMEOUT)
+        version = client_hello[32]
+        if version == KDF_RESUME:
+            length = int.from_bytes(await asyncio.wait_for(reader.readexactly(2), HANDSHAKE_TIMEOUT), 'big')
+            ticket = await asyncio.wait_for(reader.readexactly(length), HANDSHAKE_TIMEOUT)
+            secret = self.tickets.redeem(ticket)
+            if secret is not None:
+                # 恢复会话只需一次AES-GCM解密和一次HKDF
+                METRICS.incr("handshakes_resumed")
+                return resumed_session_key(secret, salt, client_hello[:32])
+            METRICS.incr("resume_rejected")
+            AsyncFrameWriter(writer).send(MSG_RESUME_REJECTED)
+            client_hello = await asyncio.wait_for(reader.readexactly(33), HANDSHAKE_TIMEOUT)
+            version = client_hello[32]
+        if version not in self.versions:
+            raise ValueError(f"不支持的协议版本：{version}")
+        shared_key = private_key.exchange(x25519.X25519PublicKey.from_public_bytes(client_hello[:32]))
+        # scrypt在有界的进程池中执行，排队已满时直接拒绝，不阻塞事件循环；kdf耗时包含排队时间
+        with METRICS.timer("kdf"):
+            aes_key = await self.kdf_pool.derive(shared_key, salt, version)
+        METRICS.incr(f"handshakes_v{version}")
+        return aes_key
+
+    async def receive_loop(self, client, reader):
+        while True:
+            frame = await read_frame_async(reader)
+            if frame is None:
+                return
+            METRICS.incr("bytes_in", FRAME_HEADER.size + len(frame.payload))
+            if frame.msg_type != MSG_DATA:
+                continue
+            start = time.perf_counter_ns()
+            try:
+                plaintext = bytes(client.session.open(frame.payload, frame.header))
+            except Exception:
+                METRICS.incr("resend")
+                await client.enqueue((MSG_RESEND, frame.seq.to_bytes(4, 'big')))
+                continue
+            METRICS.observe("open", time.perf_counter_ns() - start)
+            await self.broadcast(client, plaintext)
+
+    async def broadcast(self, sender, plaintext):
+        # 先放入所有未满的队列，只对已满的对端等待，一个慢客户端不会推迟其他客户端收到消息
+        full = [client for client in list(self.clients)
+                if client is not sender and not client.try_enqueue(plaintext)]
+        if full:
+            # 等待期间发送方的读取暂停，由TCP把背压传回发送方；等待有上限，见enqueue
+            await asyncio.gather(*(client.enqueue(plaintext) for client in full))
+
+async def serve(host=SERVER_HOST, port=SERVER_PORT, kdf_workers=None, max_pending=1024,
+                versions=PROTOCOL_VERSIONS, ticket_cache=100000, metrics_port=METRICS_PORT, metrics_interval=0):
+    if metrics_port:
+        x25519_metrics.serve_metrics(METRICS, '127.0.0.1', metrics_port)
+        logging.info("指标端点：http://127.0.0.1:%d/metrics", metrics_port)
+    if metrics_interval:
+        x25519_metrics.dump_periodically(METRICS, metrics_interval)
+    kdf_pool = KeyDerivationPool(kdf_workers, max_pending)
+    server = ChatServer(kdf_pool, TicketStore(ticket_cache), versions)
+    listener = await asyncio.start_server(server.handle_connection, host, port, backlog=LISTEN_BACKLOG)
+    logging.info(f"服务器启动，正在监听端口 {port}...")
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        kdf_pool.shutdown()
+
+# -------------------- 压力测试客户端 --------------------
+def raise_fd_limit():
+    """上千个连接需要足够的文件描述符"""
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+async def client_handshake(reader, writer, kdf_pool, version, resume=None):
+    """客户端握手，优先使用票据恢复；返回(SessionCipher, 新票据, 是否为恢复的会话)"""
+    data = await reader.readexactly(48)
+    salt = data[32:48]
+    aes_key = None
+    frame = None
+    resumed = False
+    if resume is not None:
+        hello, client_random = resume_hello(resume.ticket)
+        writer.write(hello)
+        await writer.drain()
+        frame = await read_frame_async(reader)
+        if frame is not None and frame.msg_type != MSG_RESUME_REJECTED:
+            aes_key = resumed_session_key(resume.secret, salt, client_random)
+            resumed = True
+    if aes_key is None:
+        private_key = x25519.X25519PrivateKey.generate()
+        writer.write(raw_public_bytes(private_key) + bytes([version]))
+        await writer.drain()
+        shared_key = private_key.exchange(x25519.X25519PublicKey.from_public_bytes(data[:32]))
+        aes_key = await kdf_pool.derive(shared_key, salt, version)
+        frame = await read_frame_async(reader)
+    session = SessionCipher(aes_key, is_server=False)
+    ticket = None
+    # 等服务器登记完会话（MSG_READY）再返回，否则先连上的客户端发出的消息可能送不到它
+    while frame is None or frame.msg_type != MSG_READY:
+        if frame is None:
+            raise ConnectionError("服务器未确认会话")
+        if frame.msg_type == MSG_TICKET:
+            ticket = ResumptionTicket(bytes(session.open(frame.payload, frame.header)), resumption_secret(aes_key))
+        frame = await read_frame_async(reader)
+    return session, ticket, resumed
+
+async def _load_session(host, port, stats, all_connected, payload, messages, kdf_pool, version, reconnect):
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+        start = time.perf_counter()
+        session, ticket, _ = await client_handshake(reader, writer, kdf_pool, version)
+        stats["handshake"].append(time.perf_counter() - start)
+        stats["connected"] += 1
+    finally:
+        stats["settled"] += 1
+        if stats["settled"] == stats["sessions"]:
+            stats["settle_time"] = time.perf_counter() - stats["start"]
+            all_connected.set()
+
+    async def receive():
+        received = 0
+        while received < expected:
+            frame = await read_frame_async(reader)
+            if frame is None:
+                break
+            if frame.msg_type == MSG_DATA:
+                session.open(frame.payload, frame.header)
+                received += 1
+        stats["received"] += received
+
+    await all_connected.wait()
+    # 只有成功握手的会话会收到广播
+    expected = (stats["connected"] - 1) * messages
+    receiver = asyncio.create_task(receive())
+    frames = AsyncFrameWriter(writer)
+    for _ in range(messages):
+        frames.send_sealed(session, payload)
+        await frames.drain()
+    await receiver
+    writer.close()
+    if reconnect:
+        # 模拟网络抖动后的集中重连：用票据恢复会话
+        reader, writer = await asyncio.open_connection(host, port)
+        start = time.perf_counter()
+        _, _, resumed = await client_handshake(reader, writer, kdf_pool, version, ticket)
+        stats["resume"].append(time.perf_counter() - start)
+        stats["resumed"] += resumed
+        writer.close()
+
+async def load_test(sessions, messages, size, host='localhost', port=SERVER_PORT, version=KDF_SCRYPT,
+                    reconnect=False, timeout=300):
+    """打开sessions个会话，每个会话发送messages条消息，统计握手耗时和转发吞吐"""
+    raise_fd_limit()
+    kdf_pool = KeyDerivationPool(max_pending=sessions)
+    stats = {"sessions": sessions, "connected": 0, "settled": 0, "received": 0, "handshake": [],
+             "resumed": 0, "resume": []}
+    all_connected = asyncio.Event()
+    payload = os.urandom(size)
+    start = stats["start"] = time.perf_counter()
+    tasks = [asyncio.create_task(_load_session(host, port, stats, all_connected, payload, messages,
+                                               kdf_pool, version, reconnect))
+             for _ in range(sessions)]
+    done, pending = await asyncio.wait(tasks, timeout=timeout)
+    for task in pending:
+        task.cancel()
+    elapsed = time.perf_counter() - start
+    kdf_pool.shutdown()
+    failures = sum(1 for task in done if task.exception() is not None) + len(pending)
+    handshakes = sorted(stats["handshake"])
+    print(f"会话: {stats['connected']}/{sessions}，失败 {failures}，总耗时 {elapsed:.2f} 秒")
+    if handshakes:
+        print(f"握手耗时: 中位数 {handshakes[len(handshakes) // 2] * 1000:.1f} ms，"
+              f"最大 {handshakes[-1] * 1000:.1f} ms，"
+              f"全部完成用时 {stats['settle_time']:.2f} 秒（{len(handshakes) / stats['settle_time']:,.0f} 次/秒）")
+    print(f"转发消息: {stats['received']}/{stats['connected'] * (stats['connected'] - 1) * messages}，"
+          f"{stats['received'] / elapsed:,.0f} 条/秒")
+    if reconnect and stats["resume"]:
+        resumes = sorted(stats["resume"])
+        print(f"票据重连: {stats['resumed']}/{len(resumes)} 次恢复成功，"
+              f"耗时中位数 {resumes[len(resumes) // 2] * 1000:.1f} ms，最大 {resumes[-1] * 1000:.1f} ms")
+
+# -------------------- 命令行 --------------------
+def main():
+    parser = argparse.ArgumentParser(description="asyncio版X25519加密聊天服务器")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("serve", help="启动服务器")
+    p.add_argument("--host", default=SERVER_HOST)
+    p.add_argument("--port", type=int, default=SERVER_PORT)
+    p.add_argument("--kdf-workers", type=int, default=None, help="密钥派生进程数，默认为CPU核数")
+    p.add_argument("--max-pending", type=int, default=1024, help="排队中的握手上限，超出的连接被拒绝")
+    p.add_argument("--versions", type=int, nargs="+", default=list(PROTOCOL_VERSIONS),
+                   help="允许的协议版本：1=scrypt，2=HKDF")
+    p.add_argument("--ticket-cache", type=int, default=100000, help="会话恢复票据缓存的条目上限")
+    p.add_argument("--metrics-port", type=int, default=METRICS_PORT, help="本机指标端点端口，0为关闭")
+    p.add_argument("--metrics-interval", type=int, default=0, help="每隔多少秒把指标写入日志，0为关闭")
+    p = sub.add_parser("loadtest", help="对本机服务器做并发会话压力测试")
+    p.add_argument("-n", "--sessions", type=int, default=100)
+    p.add_argument("-m", "--messages", type=int, default=10, help="每个会话发送的消息数")
+    p.add_argument("--size", type=int, default=64, help="消息长度（字节）")
+    p.add_argument("--host", default='localhost')
+    p.add_argument("--port", type=int, default=SERVER_PORT)
+    p.add_argument("--version", type=int, default=KDF_SCRYPT, choices=PROTOCOL_VERSIONS)
+    p.add_argument("--reconnect", action="store_true", help="结束后所有会话断开并用票据重连")
+    args = parser.parse_args()
+    if args.command == "serve":
+        configure_logging()
+        asyncio.run(serve(args.host, args.port, args.kdf_workers, args.max_pending, tuple(args.versions),
+                          args.ticket_cache, args.metrics_port, args.metrics_interval))
+    else:
+        asyncio.run(load_test(args.sessions, args.messages, args.size, args.host, args.port, args.version,
+                              args.reconnect))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+import time
+import queue
+import atexit
+import logging
+import threading
+import logging.handlers
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# -------------------- 延迟直方图 --------------------
+# HDR风格的对数-线性分桶：每个2的幂区间再均分为SUB_BUCKETS/2个桶，相对误差不超过约6%，
+# 记录一次只需几次整数运算，内存固定，不保存原始样本
+SUB_BITS = 5
+SUB_BUCKETS = 1 << SUB_BITS
+HALF_BUCKETS = SUB_BUCKETS // 2
+MAX_BUCKETS = (64 - SUB_BITS + 2) * HALF_BUCKETS
+
+def _bucket_index(value):
+    if value < SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - SUB_BITS
+    return shift * HALF_BUCKETS + (value >> shift)
+
+def _bucket_value(index):
+    """桶的代表值（区间中点）"""
+    if index < SUB_BUCKETS:
+        return index
+    shift = index // HALF_BUCKETS - 1
+    return ((index - shift * HALF_BUCKETS) << shift) + (1 << shift) // 2
+
+class Histogram:
+    """记录纳秒级耗时（或任意非负整数）的直方图"""
+    def __init__(self):
+        self._counts = [0] * MAX_BUCKETS
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, value):
+        index = _bucket_index(value)
+        with self._lock:
+            self._counts[index] += 1
+            self.count += 1
+            self.total += value
+            if value > self.max:
+                self.max = value
+
+    def percentiles(self, quantiles):
+        """一次遍历求多个分位数，quantiles需按升序排列"""
+        with self._lock:
+            counts = list(self._counts)
+            count = self.count
+            largest = self.max
+        results = []
+        targets = iter(quantiles)
+        target = next(targets, None)
+        seen = 0
+        for index, n in enumerate(counts):
+            seen += n
+            while target is not None and count and seen >= target * count:
+                results.append(min(_bucket_value(index), largest))
+                target = next(targets, None)
+            if target is None:
+                break
+        results.extend(0 for _ in range(len(quantiles) - len(results)))
+        return results
+
+# -------------------- 指标集合 --------------------
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+class Metrics:
+    """计数器和直方图按名称登记；热路径上只做整数累加，格式化留到导出时"""
+    def __init__(self):
+        self.counters = defaultdict(int)
+        self.histograms = defaultdict(Histogram)
+        self._lock = threading.Lock()
+        self.started = time.time()
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def observe(self, name, nanoseconds):
+        self.histograms[name].record(nanoseconds)
+
+    def timer(self, name):
+        return _Timer(self.histograms[name])
+
+    def render(self):
+        """文本格式导出，每行一个数值，便于grep和脚本解析"""
+        lines = [f"uptime_seconds {time.time() - self.started:.0f}"]
+        with self._lock:
+            counters = sorted(self.counters.items())
+        for name, value in counters:
+            lines.append(f"{name} {value}")
+        for name, histogram in sorted(self.histograms.items()):
+            count = histogram.count
+            lines.append(f"{name}_count {count}")
+            if not count:
+                continue
+            lines.append(f"{name}_mean_us {histogram.total / count / 1000:.1f}")
+            for q, value in zip(QUANTILES, histogram.percentiles(QUANTILES)):
+                lines.append(f"{name}_p{q * 100:g}_us {value / 1000:.1f}")
+            lines.append(f"{name}_max_us {histogram.max / 1000:.1f}")
+        return "\n".join(lines) + "\n"
+
+class _Timer:
+    """with METRICS.timer("kdf"): ... 记录代码块的耗时"""
+    __slots__ = ("_histogram", "_start")
+
+    def __init__(self, histogram):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.record(time.perf_counter_ns() - self._start)
+        return False
+
+METRICS = Metrics()
+
+# -------------------- 导出 --------------------
+def serve_metrics(metrics=METRICS, host='127.0.0.1', port=9465):
+    """在后台线程提供 GET /metrics 文本端点，返回HTTP服务器对象"""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = metrics.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+def dump_periodically(metrics=METRICS, interval=60, logger=None):
+    """每隔interval秒把全部指标写入日志"""
+    logger = logger or logging.getLogger("metrics")
+
+    def run():
+        while True:
+            time.sleep(interval)
+            logger.info("指标快照：\n%s", metrics.render())
+
+    thread = threading.Thread(target=run, name="metrics-dump", daemon=True)
+    thread.start()
+    return thread
+
+# -------------------- 日志 --------------------
+# 显示聊天内容的日志器：内容本身不是诊断信息，不能被限流丢弃
+CHAT_LOGGER = "chat"
+
+class RateLimitFilter(logging.Filter):
+    """按日志模板（未格式化的msg）做令牌桶限流，被丢弃的条数附在下一条放行的日志后面；
+    exempt中的日志器（及其子日志器）不限流"""
+    def __init__(self, rate=10.0, burst=20, exempt=(CHAT_LOGGER,)):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.exempt = tuple(exempt)
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.name in self.exempt or record.name.startswith(tuple(f"{name}." for name in self.exempt)):
+            return True
+        key = (record.name, record.levelno, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            tokens, last, dropped = self._buckets.get(key, (self.burst, now, 0))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now, dropped + 1)
+                return False
+            self._buckets[key] = (tokens - 1, now, 0)
+        if dropped:
+            record.msg = f"{record.msg}（此前 {dropped} 条相同日志被限流）"
+        return True
+
+def configure_logging(filename, level=logging.INFO, console=True, rate=10.0, burst=20, exempt=(CHAT_LOGGER,)):
+    """日志经QueueHandler交给后台线程写文件，调用线程不做磁盘I/O；返回QueueListener"""
+    formatter = logging.Formatter('%(asctime)s [%(levelname)s] %(message)s')
+    handlers = [logging.FileHandler(filename, encoding="utf-8")]
+    if console:
+        handlers.append(logging.StreamHandler())
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter(rate, burst, exempt))
+    root = logging.getLogger()
+    root.setLevel(level)
+    # 去掉此前配置的处理器（如basicConfig），否则每条日志会被重复输出，且绕过队列和限流同步写盘
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        handler.close()
+    root.addHandler(queue_handler)
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    # 退出前把队列中剩余的日志写完
+    atexit.register(listener.stop)
+    return listener
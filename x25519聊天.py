@@ -1,63 +1,29 @@
 #!/usr/bin/env python3
 import socket
 import threading
-import os
 import time
 import logging
-from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives.asymmetric import x25519
-from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.primitives import serialization
+from x25519_session import (SessionCipher, FrameReader, FrameWriter, CoalescingSender, MSG_RESEND, MSG_ERROR,
+                            MSG_READY, MSG_TICKET, MSG_RESUME_REJECTED, ResumptionTicket, generate_aes_key,
+                            recv_exact, resume_hello, resumed_session_key, resumption_secret, KDF_SCRYPT)
 
 # -------------------- 配置日志 --------------------
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s [%(levelname)s] %(message)s',
-    handlers=[
-        logging.FileHandler("client.log", encoding="utf-8"),
-        logging.StreamHandler()
-    ]
-)
+def configure_client_logging():
+    """只在运行客户端时配置；服务器部分由configure_logging接管根日志器"""
+    logging.basicConfig(
+        level=logging.DEBUG,
+        format='%(asctime)s [%(levelname)s] %(message)s',
+        handlers=[
+            logging.FileHandler("client.log", encoding="utf-8"),
+            logging.StreamHandler()
+        ]
+    )
 
 # -------------------- 服务器地址 --------------------
 SERVER_ADDRESS = ('localhost', 65432)
-
-# -------------------- AES-GCM加密函数 --------------------
-def aes_gcm_encrypt(key, plaintext):
-    nonce = os.urandom(12)
-    cipher = Cipher(algorithms.AES(key), modes.GCM(nonce), backend=default_backend())
-    encryptor = cipher.encryptor()
-    ciphertext = encryptor.update(plaintext) + encryptor.finalize()
-    logging.debug("【加密】生成nonce、tag和密文")
-    return nonce + encryptor.tag + ciphertext
-
-# -------------------- AES-GCM解密函数 --------------------
-def aes_gcm_decrypt(key, ciphertext):
-    nonce = ciphertext[:12]
-    tag = ciphertext[12:28]
-    cipher = Cipher(algorithms.AES(key), modes.GCM(nonce, tag), backend=default_backend())
-    decryptor = cipher.decryptor()
-    plaintext = decryptor.update(ciphertext[28:]) + decryptor.finalize()
-    logging.debug("【解密】数据解密成功")
-    return plaintext
-
-# -------------------- 生成AES密钥 --------------------
-def generate_aes_key(private_key, peer_public_key, salt):
-    shared_key = private_key.exchange(peer_public_key)
-    
-    kdf = Scrypt(
-        salt=salt,
-        length=32,
-        n=2**14,
-        r=8,
-        p=1,
-        backend=default_backend()
-    )
-    
-    aes_key = kdf.derive(shared_key)
-    logging.debug("【密钥】AES密钥生成成功")
-    return aes_key
+PROTOCOL_VERSION = KDF_SCRYPT  # 会话密钥派生方式，KDF_HKDF可显著降低握手开销
 
 # -------------------- 重连并建立会话 --------------------
 def connect_to_server():
@@ -73,28 +39,40 @@ def connect_to_server():
             time.sleep(3)
 
 # -------------------- 接收数据线程 --------------------
-def client_receive(s, aes_key):
+def client_receive(reader, session, writer):
     while True:
         try:
-            data = s.recv(4096)
+            frame = reader.read_frame()
             
-            if not data:
+            if frame is None:
                 logging.warning("【接收】连接已断开（空数据）")
                 break
             
-            if data.startswith(b"RESEND") or data.startswith(b"ERROR"):
-                logging.warning("【接收】收到服务器反馈：" + data.decode('utf-8'))
+            if frame.msg_type == MSG_RESEND:
+                logging.warning(f"【接收】收到服务器反馈：RESEND {int.from_bytes(frame.payload, 'big')}")
+                continue
+            
+            if frame.msg_type == MSG_ERROR:
+                logging.warning("【接收】收到服务器反馈：ERROR")
+                continue
+            
+            if frame.msg_type == MSG_READY:
+                logging.info("【接收】服务器会话已就绪")
+                continue
+            
+            if frame.msg_type == MSG_TICKET:
+                logging.debug("【接收】忽略额外的会话票据")
                 continue
             
             try:
-                plaintext = aes_gcm_decrypt(aes_key, data)
-                logging.info("【接收】接收到消息：" + plaintext.decode('utf-8'))
+                plaintext = session.open(frame.payload, frame.header)
+                logging.info("【接收】接收到消息：" + str(plaintext, 'utf-8'))
                 
             except Exception as de:
                 logging.error(f"【接收】解密失败：{de}")
                 
                 try:
-                    s.sendall(b"ERROR")
+                    writer.send(MSG_ERROR, seq=frame.seq)
                     logging.info("【发送】发送错误反馈：ERROR")
                     
                 except Exception as send_err:
@@ -105,51 +83,89 @@ def client_receive(s, aes_key):
             break
 
 # -------------------- 发送数据线程 --------------------
-def client_send(s, aes_key):
-    message_counter = 0
-    
+def client_send(session, writer):
+    # 连续输入（如粘贴多行）时多条消息合并成一次写出
+    sender = CoalescingSender(writer, session)
     while True:
         try:
             msg = input("客户端输入消息：").encode('utf-8')
-            encrypted = aes_gcm_encrypt(aes_key, msg)
-            s.sendall(encrypted)
-            logging.info(f"【发送】消息 {message_counter} 发送成功")
-            message_counter += 1
+            sender.send(msg)
+            logging.info("【发送】消息已加入发送队列")
             
         except Exception as e:
             logging.error(f"【发送】发送线程异常：{e}")
             break
+    sender.close()
 
 # -------------------- 客户端主函数 --------------------
+def client_handshake(s, ticket):
+    """完成握手，返回会话密钥和第一帧；持有票据时先尝试恢复会话，被拒绝则回退到完整握手"""
+    data = recv_exact(s, 48)
+    
+    if len(data) != 48:
+        raise ConnectionError("服务器数据格式不正确")
+    
+    server_public_key_bytes = data[:32]
+    salt = data[32:48]
+    logging.debug("收到服务器公钥和salt")
+    reader = FrameReader(s)
+    
+    if ticket is not None:
+        hello, client_random = resume_hello(ticket.ticket)
+        s.sendall(hello)
+        aes_key = resumed_session_key(ticket.secret, salt, client_random)
+        frame = reader.read_frame()
+        
+        if frame is None:
+            raise ConnectionError("恢复会话时连接断开")
+        
+        if frame.msg_type != MSG_RESUME_REJECTED:
+            logging.info("【会话】使用票据恢复会话")
+            return aes_key, reader, frame
+        
+        logging.info("【会话】票据被拒绝，进行完整握手")
+    
+    client_private_key = x25519.X25519PrivateKey.generate()
+    client_public_key = client_private_key.public_key()
+    logging.info("生成客户端X25519密钥对")
+    server_public_key = x25519.X25519PublicKey.from_public_bytes(server_public_key_bytes)
+    client_pub_bytes = client_public_key.public_bytes(
+        encoding=serialization.Encoding.Raw,
+        format=serialization.PublicFormat.Raw
+    )
+    s.sendall(client_pub_bytes + bytes([PROTOCOL_VERSION]))
+    logging.debug("发送客户端公钥成功")
+    aes_key = generate_aes_key(client_private_key, server_public_key, salt, PROTOCOL_VERSION)
+    return aes_key, reader, reader.read_frame()
+
 def client_main():
+    ticket = None  # 上一次会话拿到的票据，重连时用来跳过密钥协商
     while True:
         try:
             s = connect_to_server()
             
-            client_private_key = x25519.X25519PrivateKey.generate()
-            client_public_key = client_private_key.public_key()
-            logging.info("生成客户端X25519密钥对")
-            
-            data = s.recv(48)
-            
-            if len(data) != 48:
-                logging.error("【会话】服务器数据格式不正确")
+            try:
+                aes_key, reader, frame = client_handshake(s, ticket)
+            except ConnectionError as e:
+                logging.error(f"【会话】{e}")
+                ticket = None
                 s.close()
+                time.sleep(3)
                 continue
             
-            server_public_key_bytes = data[:32]
-            salt = data[32:48]
-            logging.debug("收到服务器公钥和salt")
-            server_public_key = x25519.X25519PublicKey.from_public_bytes(server_public_key_bytes)
-            client_pub_bytes = client_public_key.public_bytes(
-                encoding=serialization.Encoding.Raw,
-                format=serialization.PublicFormat.Raw
-            )
-            s.sendall(client_pub_bytes)
-            logging.debug("发送客户端公钥成功")
-            aes_key = generate_aes_key(client_private_key, server_public_key, salt)
-            recv_thread = threading.Thread(target=client_receive, args=(s, aes_key), daemon=True)
-            send_thread = threading.Thread(target=client_send, args=(s, aes_key), daemon=True)
+            ticket = None
+            session = SessionCipher(aes_key, is_server=False)
+            
+            if frame is not None and frame.msg_type == MSG_TICKET:
+                try:
+                    ticket = ResumptionTicket(bytes(session.open(frame.payload, frame.header)), resumption_secret(aes_key))
+                    logging.debug("收到会话票据")
+                except Exception as te:
+                    logging.error(f"【会话】票据解密失败：{te}")
+            
+            writer = FrameWriter(s)
+            recv_thread = threading.Thread(target=client_receive, args=(reader, session, writer), daemon=True)
+            send_thread = threading.Thread(target=client_send, args=(session, writer), daemon=True)
             recv_thread.start()
             send_thread.start()
             recv_thread.join()
@@ -163,6 +179,7 @@ def client_main():
             continue
 
 if __name__ == "__main__":
+    configure_client_logging()
     client_main()
 
 
@@ -177,61 +194,31 @@ import threading
 import os
 import time
 import logging
-from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives.asymmetric import x25519
-from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.primitives import serialization
+from x25519_session import (SessionCipher, FrameReader, FrameWriter, CoalescingSender, MSG_RESEND, MSG_ERROR,
+                            MSG_TICKET, MSG_RESUME_REJECTED, TicketStore, generate_aes_key, recv_exact,
+                            resumed_session_key, KDF_RESUME, PROTOCOL_VERSIONS)
+from x25519_metrics import METRICS, CHAT_LOGGER, configure_logging, serve_metrics, dump_periodically
+
+# 会话票据缓存，断线重连的客户端凭票据跳过密钥协商
+TICKETS = TicketStore()
 
 # -------------------- 配置日志 --------------------
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s [%(levelname)s] %(message)s',
-    handlers=[
-        logging.FileHandler("server.log", encoding="utf-8"),
-        logging.StreamHandler()
-    ]
-)
+# 日志由后台线程写入server.log，同一条诊断日志每秒最多约10次，收发线程不会被磁盘I/O拖慢；
+# 收到的聊天内容经chat日志器输出，不受限流影响
+configure_logging("server.log", logging.DEBUG)
+chat_log = logging.getLogger(CHAT_LOGGER)
 
 # -------------------- 服务器地址 --------------------
 SERVER_ADDRESS = ('', 65432)
+METRICS_PORT = 9465          # 指标端点 http://127.0.0.1:9465/metrics，0表示不开启
+METRICS_DUMP_INTERVAL = 60   # 每隔多少秒把指标写入日志，0表示不写
 
-# -------------------- AES-GCM加密函数 --------------------
-def aes_gcm_encrypt(key, plaintext):
-    nonce = os.urandom(12)
-    cipher = Cipher(algorithms.AES(key), modes.GCM(nonce), backend=default_backend())
-    encryptor = cipher.encryptor()
-    ciphertext = encryptor.update(plaintext) + encryptor.finalize()
-    logging.debug("【加密】生成nonce、tag和密文")
-    return nonce + encryptor.tag + ciphertext
-
-# -------------------- AES-GCM解密函数 --------------------
-def aes_gcm_decrypt(key, ciphertext):
-    nonce = ciphertext[:12]
-    tag = ciphertext[12:28]
-    cipher = Cipher(algorithms.AES(key), modes.GCM(nonce, tag), backend=default_backend())
-    decryptor = cipher.decryptor()
-    plaintext = decryptor.update(ciphertext[28:]) + decryptor.finalize()
-    logging.debug("【解密】数据解密成功")
-    return plaintext
-
-# -------------------- 生成AES密钥 --------------------
-def generate_aes_key(private_key, peer_public_key, salt):
-    shared_key = private_key.exchange(peer_public_key)   
-    kdf = Scrypt(
-        salt=salt,
-        length=32,
-        n=2**14,
-        r=8,
-        p=1,
-        backend=default_backend()
-    )
-    aes_key = kdf.derive(shared_key)
-    logging.debug("【密钥】AES密钥生成成功")
-    return aes_key
 # -------------------- 处理单个连接 --------------------
 def handle_connection(conn, addr):
-    logging.info(f"建立新会话，连接来自：{addr}")  
+    logging.info("建立新会话，连接来自：%s", addr)  
+    handshake_start = time.perf_counter_ns()
     try:
         server_private_key = x25519.X25519PrivateKey.generate()
         server_public_key = server_private_key.public_key()
@@ -243,16 +230,46 @@ def handle_connection(conn, addr):
         )
         conn.sendall(server_pub_bytes + salt)
         logging.debug("发送服务器公钥和salt成功")
-        client_public_key_bytes = conn.recv(32)  
-        if len(client_public_key_bytes) != 32:
+        client_hello = recv_exact(conn, 33)  
+        if len(client_hello) != 33:
             logging.error("客户端公钥长度错误")
             conn.close()
             return
-        client_public_key = x25519.X25519PublicKey.from_public_bytes(client_public_key_bytes)
-        logging.info("接收到客户端公钥，开始生成AES密钥") 
-        aes_key = generate_aes_key(server_private_key, client_public_key, salt) 
-        recv_thread = threading.Thread(target=server_receive, args=(conn, aes_key), daemon=True)
-        send_thread = threading.Thread(target=server_send, args=(conn, aes_key), daemon=True) 
+        version = client_hello[32]
+        aes_key = None
+        if version == KDF_RESUME:
+            ticket_len = int.from_bytes(recv_exact(conn, 2), 'big')
+            secret = TICKETS.redeem(recv_exact(conn, ticket_len))
+            if secret is not None:
+                logging.info("客户端票据有效，恢复会话")
+                METRICS.incr("handshakes_resumed")
+                aes_key = resumed_session_key(secret, salt, client_hello[:32])
+            else:
+                logging.info("客户端票据无效，要求完整握手")
+                METRICS.incr("resume_rejected")
+                FrameWriter(conn).send(MSG_RESUME_REJECTED)
+                client_hello = recv_exact(conn, 33)
+                if len(client_hello) != 33:
+                    logging.error("客户端公钥长度错误")
+                    conn.close()
+                    return
+                version = client_hello[32]
+        if aes_key is None:
+            if version not in PROTOCOL_VERSIONS:
+                logging.error(f"不支持的协议版本：{version}")
+                conn.close()
+                return
+            client_public_key = x25519.X25519PublicKey.from_public_bytes(client_hello[:32])
+            logging.info("接收到客户端公钥，开始生成AES密钥") 
+            with METRICS.timer("kdf"):
+                aes_key = generate_aes_key(server_private_key, client_public_key, salt, version) 
+            METRICS.incr(f"handshakes_v{version}")
+        session = SessionCipher(aes_key, is_server=True)
+        writer = FrameWriter(conn, METRICS)
+        writer.send_sealed(session, TICKETS.issue(aes_key), MSG_TICKET)
+        METRICS.observe("handshake", time.perf_counter_ns() - handshake_start)
+        recv_thread = threading.Thread(target=server_receive, args=(conn, session, writer), daemon=True)
+        send_thread = threading.Thread(target=server_send, args=(session, writer), daemon=True) 
         recv_thread.start()
         send_thread.start()   
         recv_thread.join()
@@ -266,46 +283,55 @@ def handle_connection(conn, addr):
             pass
         logging.info("会话结束，等待新连接。")
 # -------------------- 接收数据线程 --------------------
-def server_receive(conn, aes_key):
-    message_counter = 0  
+def server_receive(conn, session, writer):
+    reader = FrameReader(conn)
     while True:
         try:
-            data = conn.recv(4096)        
-            if not data:
+            frame = reader.read_frame()
+            if frame is None:
                 logging.warning("【接收】连接可能已断开（数据为空）")
                 break      
-            if data.startswith(b"RESEND") or data.startswith(b"ERROR"):
-                logging.warning("【接收】收到客户端错误反馈：" + data.decode('utf-8'))
+            METRICS.incr("bytes_in", len(frame.header) + len(frame.payload))
+            if frame.msg_type in (MSG_RESEND, MSG_ERROR):
+                METRICS.incr("peer_resend" if frame.msg_type == MSG_RESEND else "peer_error")
+                logging.warning("【接收】收到客户端错误反馈：类型 %d，序号 %d", frame.msg_type, frame.seq)
                 continue        
+            message_counter = frame.seq
             try:
-                plaintext = aes_gcm_decrypt(aes_key, data)
-                logging.info(f"【接收】消息 {message_counter} 收到：{plaintext.decode('utf-8')}")          
+                start = time.perf_counter_ns()
+                plaintext = session.open(frame.payload, frame.header)
+                METRICS.observe("open", time.perf_counter_ns() - start)
+                chat_log.info("【接收】消息 %d 收到：%s", message_counter, str(plaintext, 'utf-8'))          
             except Exception as de:
-                logging.error(f"【接收】消息 {message_counter} 解密失败：{de}")           
+                METRICS.incr("resend")
+                logging.error("【接收】消息 %d 解密失败：%s", message_counter, de)           
                 try:
-                    conn.sendall(f"RESEND {message_counter}".encode('utf-8'))
-                    logging.info(f"【发送】发送重传请求：RESEND {message_counter}")              
+                    writer.send(MSG_RESEND, message_counter.to_bytes(4, 'big'))
+                    logging.info("【发送】发送重传请求：RESEND %d", message_counter)              
                 except Exception as send_err:
-                    logging.error(f"【发送】重传请求发送失败：{send_err}")
-                continue        
-            message_counter += 1            
+                    logging.error("【发送】重传请求发送失败：%s", send_err)
         except Exception as e:
             logging.error(f"【接收】recv线程异常：{e}")
             break
 # -------------------- 发送数据线程 --------------------
-def server_send(conn, aes_key):
+def server_send(session, writer):
+    sender = CoalescingSender(writer, session)
     while True:
         try:
             msg = input("服务器输入消息：").encode('utf-8')
-            encrypted = aes_gcm_encrypt(aes_key, msg)
-            conn.sendall(encrypted)
-            logging.info("【发送】消息发送成功")        
+            sender.send(msg)
+            logging.info("【发送】消息已加入发送队列")        
         except Exception as e:
             logging.error(f"【发送】发送线程异常：{e}")
             break
+    sender.close()
 # -------------------- 服务器主函数 --------------------
 def server_main():
     logging.info("服务器启动，开始监听")   
+    if METRICS_PORT:
+        serve_metrics(METRICS, '127.0.0.1', METRICS_PORT)
+    if METRICS_DUMP_INTERVAL:
+        dump_periodically(METRICS, METRICS_DUMP_INTERVAL)
     while True:
         try:
             with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s: